@@ -0,0 +1,171 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, load_npz
+from sklearn.preprocessing import normalize
+from Ranking import top_k_indices
+from Content_based import ItemProfiles, build_users_profile_matrix
+from Evaluation import latency_summary
+
+
+class IVFIndex:
+    # Inverted-file index over L2-normalized item vectors: items are clustered by spherical k-means and a
+    # query is only scored exactly against the items of its n_probe closest clusters. n_probe is the
+    # recall / speed knob: n_probe = n_lists scans every item and is exact.
+    # List i holds the item rows list_items[list_offsets[i]:list_offsets[i + 1]]; list_vectors keeps the
+    # vectors in that order, so the candidates of a list are one contiguous range of CSR rows.
+
+    def __init__(self, centroids, list_offsets, list_items, list_vectors):
+        self.centroids = centroids
+        self.list_offsets = np.asarray(list_offsets)
+        self.list_items = list_items
+        self.list_vectors = list_vectors
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    @staticmethod
+    def _assign(vectors, centroids, block_size=4096):
+        # Closest centroid of every row, a block of rows at a time
+        assignments = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], block_size):
+            similarities = vectors[start:start + block_size].dot(centroids.T)
+            assignments[start:start + block_size] = np.asarray(similarities).argmax(axis=1)
+        return assignments
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, iterations=10, seed=42):
+        # Spherical k-means on the (already unit-length) rows; n_lists defaults to about sqrt(n_items)
+        vectors = csr_matrix(vectors, dtype=np.float32)
+        n_items = vectors.shape[0]
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n_items)))
+        n_lists = min(n_lists, n_items)
+        rng = np.random.default_rng(seed)
+
+        centroids = vectors[rng.choice(n_items, n_lists, replace=False)].toarray()
+        for _ in range(iterations):
+            assignments = cls._assign(vectors, centroids)
+            members = csr_matrix((np.ones(n_items, dtype=np.float32), (assignments, np.arange(n_items))),
+                                 shape=(n_lists, n_items))
+            centroids = normalize(np.asarray(members.dot(vectors).todense()))
+
+            # An empty cluster is re-seeded with a random item
+            empty = np.flatnonzero(np.asarray(members.sum(axis=1)).ravel() == 0)
+            if len(empty):
+                centroids[empty] = vectors[rng.choice(n_items, len(empty), replace=False)].toarray()
+
+        assignments = cls._assign(vectors, centroids)
+        list_items = np.argsort(assignments, kind='stable').astype(np.int64)
+        list_offsets = np.searchsorted(assignments[list_items], np.arange(n_lists + 1))
+        return cls(centroids.astype(np.float32), list_offsets, list_items, vectors[list_items])
+
+    @staticmethod
+    def _sparse_query(query):
+        # (term indices, weights) of a query given as a sparse row or a dense vector
+        if hasattr(query, 'tocsr'):
+            query = query.tocsr()
+            return query.indices, query.data.astype(np.float32)
+        query = np.asarray(query, dtype=np.float32).ravel()
+        terms = np.flatnonzero(query)
+        return terms, query[terms]
+
+    def search(self, query, k, n_probe=8, mask=None):
+        # query: unit-length profile, sparse row or dense. Returns (item rows, scores) of the k best
+        # candidates, best first; rows where mask is True are skipped
+        terms, weights = self._sparse_query(query)
+        probe = top_k_indices(self.centroids[:, terms].dot(weights), min(n_probe, self.n_lists))
+
+        # Exact scores of the probed lists, touching only their nonzeros: one gather of the query weights
+        # per nonzero and a bincount per candidate row
+        starts, stops = self.list_offsets[probe], self.list_offsets[probe + 1]
+        positions = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)])
+        indptr = self.list_vectors.indptr
+        row_nnz = indptr[positions + 1] - indptr[positions]
+        nonzeros = np.concatenate([np.arange(indptr[start], indptr[stop]) for start, stop in zip(starts, stops)])
+
+        dense_query = np.zeros(self.list_vectors.shape[1], dtype=np.float32)
+        dense_query[terms] = weights
+        contributions = self.list_vectors.data[nonzeros] * dense_query[self.list_vectors.indices[nonzeros]]
+        scores = np.bincount(np.repeat(np.arange(len(positions)), row_nnz), weights=contributions,
+                             minlength=len(positions))
+
+        rows = self.list_items[positions]
+        if mask is not None:
+            keep = ~mask[rows]
+            rows, scores = rows[keep], scores[keep]
+        best = top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+
+def recall_latency_benchmark(index, queries, k=10, n_probes=(1, 2, 4, 8, 16, 32), repeats=1):
+    # Recall@k of the index against the exact scan over the same vectors, and the latency of both
+    # The exact scan is the one ContentBasedRecommender runs: every item vector against a dense profile
+    vectors = index.list_vectors
+    exact_latencies, exact_results = [], []
+    for query in queries:
+        dense_query = np.asarray(query.todense()).ravel()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            exact = index.list_items[top_k_indices(vectors.dot(dense_query), k)]
+        exact_latencies.append((time.perf_counter() - start) / repeats)
+        exact_results.append(set(exact.tolist()))
+
+    report = {'n_items': vectors.shape[0], 'n_lists': index.n_lists, 'k': k, 'queries': len(queries),
+              'exact_latency_ms': latency_summary(exact_latencies), 'ivf': []}
+    for n_probe in n_probes:
+        latencies, recalls = [], []
+        for query, exact in zip(queries, exact_results):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                rows, _ = index.search(query, k, n_probe)
+            latencies.append((time.perf_counter() - start) / repeats)
+            recalls.append(len(exact & set(rows.tolist())) / max(len(exact), 1))
+
+        summary = latency_summary(latencies)
+        report['ivf'].append({'n_probe': n_probe, 'recall@%d' % k: float(np.mean(recalls)),
+                              'latency_ms': summary,
+                              'speedup_p50': report['exact_latency_ms']['p50'] / summary['p50']})
+    return report
+
+
+if __name__ == '__main__':
+    # Run from Module_3, e.g.:
+    # python Models/ANN.py --books books.csv --interactions interactions.csv --out ann_benchmark.json
+    parser = argparse.ArgumentParser(description='Recall vs latency of the IVF index against the exact cosine scan')
+    parser.add_argument('--tfidf', default='./pages/Datasets/tfidf_matrix.npz')
+    parser.add_argument('--books', required=True, help='CSV of the selected books (row order of the TF-IDF matrix)')
+    parser.add_argument('--interactions', default=None, help='queries are user profiles; default: item vectors')
+    parser.add_argument('--n-lists', type=int, default=None)
+    parser.add_argument('--n-probes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default=None, help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    item_profiles = ItemProfiles(load_npz(args.tfidf), pd.read_csv(args.books)['Uid'].values)
+    start = time.perf_counter()
+    index = IVFIndex.build(item_profiles.tfidf_matrix_norm, n_lists=args.n_lists, seed=args.seed)
+    build_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(args.seed)
+    if args.interactions:
+        _, profiles = build_users_profile_matrix(pd.read_csv(args.interactions), item_profiles)
+    else:
+        profiles = item_profiles.tfidf_matrix_norm
+    sample = rng.choice(profiles.shape[0], min(args.queries, profiles.shape[0]), replace=False)
+    queries = [profiles[i] for i in sample]
+
+    report = recall_latency_benchmark(index, queries, k=args.k, n_probes=args.n_probes)
+    report['build_seconds'] = build_seconds
+
+    report_json = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report_json)
+    else:
+        print(report_json)
@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, load_npz
+
+from Interactions import InteractionMatrix
+from Collaborative_Filtering import CF_ENGINES, ALSModel, SVDModel, fit_cf_model
+from Content_based import ItemProfiles
+from Popularity import GenreLeaderboards
+from Genre_index import GenreIndex
+from Item_based import ItemNeighbors
+from ANN import IVFIndex
+from Embeddings import BookEmbeddings
+from Datasets import SNAPSHOT_DIR, dataset_sources, load_dataset, read_table
+
+# Bumped whenever the on-disk layout changes, so an old build is never read with a newer loader
+ARTIFACT_FORMAT = 2
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+
+
+class ArtifactWriter:
+    # Writes plain, uncompressed .npy files plus a manifest into a new version directory
+
+    def __init__(self, root, version=None):
+        self.root = root
+        self.version = version or time.strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(root, self.version)
+        self.manifest = {'format': ARTIFACT_FORMAT, 'version': self.version, 'created': time.time(),
+                         'arrays': {}, 'sparse': {}, 'scalars': {}}
+        os.makedirs(self.path)
+
+    def add_array(self, name, array):
+        array = np.ascontiguousarray(array)
+        np.save(os.path.join(self.path, name + '.npy'), array, allow_pickle=False)
+        self.manifest['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    def add_sparse(self, name, matrix):
+        matrix = csr_matrix(matrix)
+        matrix.sort_indices()
+        for part in ('data', 'indices', 'indptr'):
+            self.add_array('%s.%s' % (name, part), getattr(matrix, part))
+        self.manifest['sparse'][name] = {'shape': list(matrix.shape)}
+
+    def add_scalar(self, name, value):
+        self.manifest['scalars'][name] = value
+
+    def commit(self):
+        with open(os.path.join(self.path, MANIFEST_FILE), 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+
+        # Switch CURRENT only once the whole version is on disk
+        current_tmp = os.path.join(self.root, CURRENT_FILE + '.tmp')
+        with open(current_tmp, 'w') as f:
+            f.write(self.version)
+        os.replace(current_tmp, os.path.join(self.root, CURRENT_FILE))
+        return self.path
+
+
+class ModelArtifacts:
+    # Read side of the layout; arrays are memory-mapped so processes on one host share the same pages
+
+    def __init__(self, root, version=None, mmap_mode='r'):
+        if version is None:
+            version = current_version(root)
+        self.root = root
+        self.path = os.path.join(root, version)
+        self.mmap_mode = mmap_mode
+
+        with open(os.path.join(self.path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest['format'] != ARTIFACT_FORMAT:
+            raise ValueError('Artifact format %s is not supported (expected %s)'
+                             % (self.manifest['format'], ARTIFACT_FORMAT))
+        self.version = self.manifest['version']
+
+    def __contains__(self, name):
+        return name in self.manifest['arrays'] or name in self.manifest['sparse']
+
+    def array(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode=self.mmap_mode, allow_pickle=False)
+
+    def sparse(self, name):
+        shape = tuple(self.manifest['sparse'][name]['shape'])
+        return csr_matrix((self.array(name + '.data'), self.array(name + '.indices'), self.array(name + '.indptr')),
+                          shape=shape, copy=False)
+
+    def scalar(self, name):
+        return self.manifest['scalars'][name]
+
+    def item_profiles(self, space='tfidf'):
+        # space='embedding': profiles in the dense LSA space of the build, if it stored one
+        if space == 'embedding':
+            embeddings = BookEmbeddings(self.array('content_embeddings'), self.array('content_embeddings_norm'))
+            return ItemProfiles(None, self.array('content_item_ids'), embeddings=embeddings)
+        return ItemProfiles(self.sparse('tfidf'), self.array('content_item_ids'),
+                            tfidf_matrix_norm=self.sparse('tfidf_norm'))
+
+    def svd_model(self):
+        # CF factors of either engine; builds without a cf_engine scalar are SVD
+        factors = (self.array('svd_user_factors'), self.array('svd_Vt'), self.array('svd_user_ids'),
+                   self.array('svd_item_ids'), self.scalar('svd_pred_min'), self.scalar('svd_pred_max'))
+        if self.manifest['scalars'].get('cf_engine', 'svd') == 'als':
+            return ALSModel(*factors, alpha=self.scalar('als_alpha'), regularization=self.scalar('als_regularization'))
+        return SVDModel(*factors)
+
+    def ann_index(self):
+        # IVF index over the normalized TF-IDF rows, or None for a build without one
+        if 'ann_list_vectors' not in self:
+            return None
+        return IVFIndex(self.array('ann_centroids'), self.array('ann_list_offsets'), self.array('ann_list_items'),
+                        self.sparse('ann_list_vectors'))
+
+    def item_neighbors(self):
+        # Item-based CF neighbor lists, or None for a build with --neighbors 0
+        if 'item_neighbors' not in self:
+            return None
+        return ItemNeighbors(self.sparse('item_neighbors'), self.array('svd_item_ids'))
+
+    def item_popularity(self):
+        return pd.DataFrame({'Uid': self.array('popularity_uid'), 'Review_Rating': self.array('popularity_score')})
+
+    def genre_index(self):
+        # Genre bitmaps over the content_item_ids rows, or None for a build without them
+        if 'genre_index_bitmaps' not in self:
+            return None
+        return GenreIndex(self.array('genre_index_names').tolist(), self.array('genre_index_bitmaps'),
+                          self.array('content_item_ids'))
+
+    def genre_leaderboards(self):
+        return GenreLeaderboards(self.array('genre_names').tolist(), self.array('genre_offsets'),
+                                 self.array('genre_board_uids'), self.array('genre_board_scores'))
+
+
+def current_version(root):
+    with open(os.path.join(root, CURRENT_FILE)) as f:
+        return f.read().strip()
+
+
+def artifacts_available(root):
+    return os.path.exists(os.path.join(root, CURRENT_FILE))
+
+
+def load_artifacts(root, version=None):
+    return ModelArtifacts(root, version)
+
+
+def build_artifacts(root, interactions_df, books_df, info_df, tfidf_matrix, k=23, cf_engine='svd',
+                    als_iterations=10, als_alpha=2.0, als_regularization=0.1, warm_start=False, n_neighbors=50,
+                    ann_lists=None, ann_index=True, embedding_dim=None):
+    # warm_start: ALS starts from the item factors of the current version instead of random ones
+    init_model = None
+    if cf_engine == 'als' and warm_start and artifacts_available(root):
+        init_model = load_artifacts(root).svd_model()
+
+    writer = ArtifactWriter(root)
+
+    # Content-based: raw rows for profile building and the L2-normalized rows used for scoring
+    item_profiles = ItemProfiles(tfidf_matrix, books_df['Uid'].values)
+    writer.add_sparse('tfidf', item_profiles.tfidf_matrix)
+    writer.add_sparse('tfidf_norm', item_profiles.tfidf_matrix_norm)
+    writer.add_array('content_item_ids', item_profiles.item_ids)
+
+    # Optional dense LSA embeddings of the same rows, embedding_dim float32 columns per book
+    if embedding_dim:
+        embeddings = BookEmbeddings.fit(item_profiles.tfidf_matrix, dim=embedding_dim)
+        writer.add_array('content_embeddings', embeddings.vectors)
+        writer.add_array('content_embeddings_norm', embeddings.vectors_norm)
+
+    # Approximate nearest-neighbor index over the normalized rows, ann_lists clusters (default ~sqrt(items))
+    if ann_index:
+        index = IVFIndex.build(item_profiles.tfidf_matrix_norm, n_lists=ann_lists)
+        writer.add_array('ann_centroids', index.centroids)
+        writer.add_array('ann_list_offsets', index.list_offsets)
+        writer.add_array('ann_list_items', index.list_items)
+        writer.add_sparse('ann_list_vectors', index.list_vectors)
+
+    # Collaborative filtering: SVD or ALS factors in the same layout, id maps and normalization bounds
+    interaction_matrix = InteractionMatrix.from_df(interactions_df[['Uid', 'UserID', 'Review_Rating']])
+    if cf_engine == 'als':
+        svd_model = fit_cf_model(interaction_matrix, 'als', k=k, iterations=als_iterations, alpha=als_alpha,
+                                 regularization=als_regularization, init_model=init_model)
+        writer.add_scalar('als_alpha', svd_model.alpha)
+        writer.add_scalar('als_regularization', svd_model.regularization)
+    else:
+        svd_model = fit_cf_model(interaction_matrix, cf_engine, k=k)
+    writer.add_scalar('cf_engine', cf_engine)
+    writer.add_array('svd_user_factors', svd_model.user_factors)
+    writer.add_array('svd_Vt', svd_model.Vt)
+    writer.add_array('svd_user_ids', svd_model.user_ids)
+    writer.add_array('svd_item_ids', svd_model.item_ids)
+    writer.add_scalar('svd_pred_min', svd_model.pred_min)
+    writer.add_scalar('svd_pred_max', svd_model.pred_max)
+
+    # Item-based CF: top-n_neighbors similar books per book, rows / columns in svd_item_ids order
+    if n_neighbors:
+        writer.add_sparse('item_neighbors', ItemNeighbors.build(interaction_matrix, n_neighbors).neighbors)
+
+    # Popularity table, already sorted by score
+    item_popularity_df = interaction_matrix.item_popularity()
+    writer.add_array('popularity_uid', item_popularity_df['Uid'].values)
+    writer.add_array('popularity_score', item_popularity_df['Review_Rating'].values)
+
+    # Per-genre popularity leaderboards
+    leaderboards = GenreLeaderboards.build(item_popularity_df, info_df)
+    writer.add_array('genre_names', np.array(leaderboards.genres, dtype=str))
+    writer.add_array('genre_offsets', leaderboards.offsets)
+    writer.add_array('genre_board_uids', leaderboards.uids)
+    writer.add_array('genre_board_scores', leaderboards.scores)
+
+    # Genre -> item bitmaps over the content-based rows, the prefilter of genre queries
+    genre_index = GenreIndex.build(item_profiles.item_ids, info_df)
+    writer.add_array('genre_index_names', np.array(genre_index.genres, dtype=str))
+    writer.add_array('genre_index_bitmaps', genre_index.bitmaps)
+
+    return writer.commit()
+
+
+if __name__ == '__main__':
+    # Offline build, run from Module_3: python Models/Artifacts.py --out ./pages/Datasets/artifacts
+    parser = argparse.ArgumentParser(description='Build the versioned model artifacts loaded by the app')
+    parser.add_argument('--out', default='./pages/Datasets/artifacts')
+    parser.add_argument('--secrets', default='./.streamlit/secrets.toml')
+    parser.add_argument('--snapshots', default=SNAPSHOT_DIR, help='local dataset snapshots (Models/Datasets.py)')
+    parser.add_argument('--interactions', help='CSV path or sheet URL, defaults to the snapshot, then secrets')
+    parser.add_argument('--books', help='CSV path or sheet URL, defaults to the snapshot, then secrets')
+    parser.add_argument('--info', help='CSV path or sheet URL, defaults to the snapshot, then secrets')
+    parser.add_argument('--tfidf', default='./pages/Datasets/tfidf_matrix.npz')
+    parser.add_argument('--k', type=int, default=23)
+    parser.add_argument('--cf-engine', choices=CF_ENGINES, default='svd')
+    parser.add_argument('--als-iterations', type=int, default=10)
+    parser.add_argument('--als-alpha', type=float, default=2.0, help='confidence per rating point')
+    parser.add_argument('--als-regularization', type=float, default=0.1)
+    parser.add_argument('--warm-start', action='store_true', help='start ALS from the current version')
+    parser.add_argument('--neighbors', type=int, default=50, help='item-based CF neighbors per book, 0 to skip')
+    parser.add_argument('--ann-lists', type=int, default=None, help='IVF clusters, default about sqrt(books)')
+    parser.add_argument('--no-ann', action='store_true', help='skip the approximate nearest-neighbor index')
+    parser.add_argument('--embedding-dim', type=int, default=None, help='also store LSA book embeddings of this size')
+    args = parser.parse_args()
+
+    sources = dataset_sources(args.secrets)
+    interactions_df, books_df, info_df = [
+        read_table(source) if source else load_dataset(name, sources.get(name), snapshot_dir=args.snapshots)
+        for name, source in (('interactions', args.interactions), ('selected_books', args.books),
+                             ('info', args.info))]
+
+    path = build_artifacts(args.out, interactions_df, books_df, info_df, load_npz(args.tfidf), k=args.k,
+                           cf_engine=args.cf_engine, als_iterations=args.als_iterations,
+                           als_alpha=args.als_alpha, als_regularization=args.als_regularization,
+                           warm_start=args.warm_start, n_neighbors=args.neighbors,
+                           ann_lists=args.ann_lists, ann_index=not args.no_ann, embedding_dim=args.embedding_dim)
+    print('Artifacts written to %s' % path)
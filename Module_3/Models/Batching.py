@@ -0,0 +1,129 @@
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Lock, Thread
+
+
+class MicroBatcher:
+    # Collects concurrent single-user scoring requests and scores them together. score_batch(inputs) gets a
+    # list of inputs and returns one score row per input, e.g. one matrix-matrix product instead of
+    # len(inputs) matrix-vector products. A batch is sent once max_batch_size requests are waiting or
+    # max_wait_ms after the first of them arrived: a larger batch is cheaper per user, a shorter wait
+    # bounds the latency added to a request that arrives alone.
+
+    def __init__(self, score_batch, max_batch_size=32, max_wait_ms=2.0, name='batcher', timeout=None):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1')
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        # Seconds score() waits for a result when the caller gives no timeout (None: no limit)
+        self.timeout = timeout
+        self.queue = Queue()
+
+        self.metrics_lock = Lock()
+        self.requests = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.queue_depth_total = 0
+        self.wait_total = 0.0
+
+        # close() and submit() take the lock, so no request is queued behind the closing sentinel
+        self.closed = False
+        self.close_lock = Lock()
+        self.thread = Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, x):
+        future = Future()
+        with self.close_lock:
+            if self.closed:
+                raise RuntimeError('MicroBatcher is closed')
+            self.queue.put((x, future, time.perf_counter()))
+        return future
+
+    def score(self, x, timeout=None):
+        return self.submit(x).result(timeout=self.timeout if timeout is None else timeout)
+
+    def _collect(self):
+        # Blocks for the first request, then gathers more until the batch is full or its deadline passes
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        queue_depth = self.queue.qsize() + 1
+        deadline = first[2] + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except Empty:
+                break
+            if item is None:
+                break
+            batch.append(item)
+
+        return batch, queue_depth
+
+    def _fail_pending(self):
+        # Requests still queued when the batcher closed get an exception instead of waiting forever
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                return
+            if item is not None:
+                item[1].set_exception(RuntimeError('MicroBatcher is closed'))
+
+    def _run(self):
+        while True:
+            collected = self._collect()
+            if collected is None:
+                self._fail_pending()
+                return
+            batch, queue_depth = collected
+            started = time.perf_counter()
+
+            with self.metrics_lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+                self.queue_depth_total += queue_depth
+                self.wait_total += sum(started - submitted for _, _, submitted in batch)
+
+            inputs = [x for x, _, _ in batch]
+            try:
+                scores = self.score_batch(inputs)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result(scores[i])
+
+            if self.closed:
+                self._fail_pending()
+                return
+
+    def metrics(self):
+        # queue_depth: requests waiting right now; mean / max_queue_depth: requests waiting when a batch started
+        with self.metrics_lock:
+            batches = max(self.batches, 1)
+            return {'requests': self.requests,
+                    'batches': self.batches,
+                    'mean_batch_size': self.requests / batches,
+                    'queue_depth': self.queue.qsize(),
+                    'mean_queue_depth': self.queue_depth_total / batches,
+                    'max_queue_depth': self.max_queue_depth,
+                    'mean_wait_ms': 1000.0 * self.wait_total / max(self.requests, 1),
+                    'max_batch_size': self.max_batch_size,
+                    'max_wait_ms': 1000.0 * self.max_wait}
+
+    def close(self):
+        # The batch being scored is finished, every request queued after it fails with RuntimeError
+        with self.close_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(None)
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+def request_key(model, genres=None, ratings=None, topn=10, genre_mode='any'):
+    # Canonical hash of a request: genre order and rating order do not matter, ratings are compared as numbers
+    canonical = {'model': model,
+                 'genres': sorted(genres) if genres is not None else None,
+                 'genre_mode': genre_mode,
+                 'ratings': sorted((int(uid), float(rating)) for uid, rating in (ratings or {}).items()),
+                 'topn': int(topn)}
+    return hashlib.sha1(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RecommendationCache:
+    # Bounded LRU of recommendation results with a time-to-live. Entries belong to one model version;
+    # set_version() with a different version drops them all, so results of older artifacts are never served.
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600.0, version=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = version
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl_seconds is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def set_version(self, version):
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def metrics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'version': self.version, 'entries': len(self.entries), 'max_entries': self.max_entries,
+                    'ttl_seconds': self.ttl_seconds, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'invalidations': self.invalidations}
@@ -1,22 +1,273 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import svds
+from Ranking import build_ignore_mask, top_k_indices
+from Sharding import ShardedScorer
+
+CF_ENGINES = ('svd', 'als')
+
+
+def prediction_bounds(user_factors, Vt, chunk_size=1024):
+    # Global min / max of user_factors . Vt, computed a block of users at a time so the full
+    # (users x items) prediction matrix never has to be held in memory
+    pred_min, pred_max = np.inf, -np.inf
+    for start in range(0, user_factors.shape[0], chunk_size):
+        block = np.dot(user_factors[start:start + chunk_size], Vt)
+        pred_min = min(pred_min, block.min())
+        pred_max = max(pred_max, block.max())
+    return pred_min, pred_max
+
+
+class SVDModel:
+    def __init__(self, user_factors, Vt, user_ids, item_ids, pred_min, pred_max):
+        # Factors are kept in float32: scoring one user reads k x items values, not a users x items table.
+        # user_factors holds the scaled rows U . diag(sigma).
+        self.user_factors = np.asarray(user_factors, dtype=np.float32)
+        self.Vt = np.ascontiguousarray(Vt, dtype=np.float32)
+        self.user_ids = np.asarray(user_ids)
+        self.item_ids = np.asarray(item_ids)
+        self.user_index = pd.Index(self.user_ids)
+        self.item_index = pd.Index(self.item_ids)
+        self.pred_min = float(pred_min)
+        self.pred_max = float(pred_max)
+        # Process pools over shared-memory shards of the item factors Vt.T, one per worker count
+        self.sharded_scorers = {}
+        self.scorer_lock = Lock()
+
+    @classmethod
+    def fit(cls, interaction_matrix, k=23):
+        U, sigma, Vt = svds(interaction_matrix.matrix, k=k)
+        user_factors = U * sigma
+
+        # Bounds of the training predictions, used to min-max normalize every later prediction
+        pred_min, pred_max = prediction_bounds(user_factors, Vt)
+
+        return cls(user_factors, Vt, interaction_matrix.user_ids, interaction_matrix.item_ids, pred_min, pred_max)
+
+    def user_vector(self, user_id):
+        # Latent row U[u] . diag(sigma) of a trained user
+        return self.user_factors[self.user_index.get_loc(user_id)]
+
+    def fold_in(self, new_user_df):
+        # Projects a new user's ratings onto the fixed item factors without retraining:
+        # u = r . Vt^T . diag(1/sigma), so its scaled latent row u . diag(sigma) is r . Vt^T
+        rows = self.item_index.get_indexer(new_user_df['Uid'].values)
+        known = rows >= 0
+        ratings = new_user_df['Review_Rating'].values[known].astype(np.float32)
+
+        return self.Vt[:, rows[known]].dot(ratings)
+
+    def predict(self, user_vector):
+        # One user's normalized predicted ratings for every item, from the precomputed global bounds
+        return self.normalize_predictions(np.dot(user_vector, self.Vt))
+
+    def normalize_predictions(self, user_predicted_ratings):
+        return (user_predicted_ratings - np.float32(self.pred_min)) / np.float32(self.pred_max - self.pred_min)
+
+    def sharded_scorer(self, n_workers):
+        # Created on first use and shared by every CFRecommender over this model
+        with self.scorer_lock:
+            if n_workers not in self.sharded_scorers:
+                self.sharded_scorers[n_workers] = ShardedScorer(self.Vt.T, n_workers)
+            return self.sharded_scorers[n_workers]
+
+    def predict_batch(self, user_vectors):
+        # Batch form of predict: stacks the latent rows so all users are scored with one matrix product
+        return self.predict(np.vstack(user_vectors))
+
+
+def _als_solve_block(matrix, fixed_factors, gram, alpha, regularization, start, stop, out):
+    # Weighted least squares for rows start..stop-1 of a CSR ratings matrix against the fixed factors Y:
+    # every cell has preference 1 if rated, else 0, with confidence 1 + alpha * rating, so
+    # x_u = (Y'Y + Y_u' diag(alpha * r_u) Y_u + regularization * I)^-1 Y_u' (1 + alpha * r_u).
+    # Y'Y (gram) is shared by all rows; the per-row corrections only involve the rated cells and are one
+    # sparse (rows x touched) . (touched x k^2) product with the outer products y_i y_i' of the touched
+    # fixed rows, so the work is O(nnz * k^2) plus one k x k solve per row.
+    indptr = matrix.indptr[start:stop + 1]
+    lo, hi = indptr[0], indptr[-1]
+    k = fixed_factors.shape[1]
+
+    touched, columns = np.unique(matrix.indices[lo:hi], return_inverse=True)
+    Y = fixed_factors[touched]
+    outer = (Y[:, :, None] * Y[:, None, :]).reshape(len(touched), k * k)
+    confidence = alpha * matrix.data[lo:hi]
+    shape = (stop - start, len(touched))
+
+    A = csr_matrix((confidence, columns, indptr - lo), shape=shape).dot(outer).reshape(-1, k, k)
+    A = A.astype(np.float64) + (gram + regularization * np.eye(k))
+    rhs = csr_matrix((1.0 + confidence, columns, indptr - lo), shape=shape).dot(Y).astype(np.float64)
+
+    out[start:stop] = np.linalg.solve(A, rhs[:, :, None])[:, :, 0]
+
+
+def als_half_step(matrix, fixed_factors, alpha, regularization, executor, block_nnz=32768):
+    # Solves every row of matrix against fixed_factors; blocks of about block_nnz nonzeros run on the executor
+    # (NumPy / SciPy release the GIL in the products and batched solves)
+    solved = np.zeros((matrix.shape[0], fixed_factors.shape[1]), dtype=np.float32)
+    gram = fixed_factors.T.astype(np.float64).dot(fixed_factors)
+    bounds = np.unique(np.concatenate([[0], np.searchsorted(matrix.indptr, np.arange(block_nnz, matrix.nnz,
+                                                                                      block_nnz)),
+                                       [matrix.shape[0]]]))
+    futures = [executor.submit(_als_solve_block, matrix, fixed_factors, gram, alpha, regularization, start, stop,
+                               solved)
+               for start, stop in zip(bounds[:-1], bounds[1:])]
+    for future in futures:
+        future.result()
+    return solved
+
+
+class ALSModel(SVDModel):
+    # Weighted ALS (implicit-feedback style): a rated cell is a positive with confidence 1 + alpha * rating,
+    # an unrated one a weak negative, instead of the rating 0 the plain SVD fits. Stored in the SVDModel
+    # layout, user_factors . Vt being the predicted preferences.
+
+    def __init__(self, user_factors, Vt, user_ids, item_ids, pred_min, pred_max, alpha=2.0, regularization=0.1):
+        super().__init__(user_factors, Vt, user_ids, item_ids, pred_min, pred_max)
+        self.alpha = float(alpha)
+        self.regularization = float(regularization)
+        self.gram = self.Vt.astype(np.float64).dot(self.Vt.T)
+
+    @classmethod
+    def fit(cls, interaction_matrix, k=23, iterations=10, alpha=2.0, regularization=0.1, init_model=None,
+            n_threads=None, seed=42):
+        # init_model: warm start from a previous model's item factors (matched by Uid); new items start random
+        user_item = interaction_matrix.matrix.tocsr()
+        item_user = user_item.T.tocsr()
+        rng = np.random.default_rng(seed)
+
+        item_factors = rng.normal(0, 0.01, (len(interaction_matrix.item_ids), k)).astype(np.float32)
+        if init_model is not None:
+            if init_model.Vt.shape[0] != k:
+                raise ValueError('Warm start needs %d factors, init_model has %d' % (k, init_model.Vt.shape[0]))
+            rows = init_model.item_index.get_indexer(interaction_matrix.item_ids)
+            known = rows >= 0
+            item_factors[known] = init_model.Vt[:, rows[known]].T
+
+        with ThreadPoolExecutor(max_workers=n_threads or os.cpu_count(), thread_name_prefix='als') as executor:
+            for _ in range(iterations):
+                user_factors = als_half_step(user_item, item_factors, alpha, regularization, executor)
+                item_factors = als_half_step(item_user, user_factors, alpha, regularization, executor)
+            user_factors = als_half_step(user_item, item_factors, alpha, regularization, executor)
+
+        Vt = item_factors.T
+        pred_min, pred_max = prediction_bounds(user_factors, Vt)
+        return cls(user_factors, Vt, interaction_matrix.user_ids, interaction_matrix.item_ids, pred_min, pred_max,
+                   alpha=alpha, regularization=regularization)
+
+    def fold_in(self, new_user_df):
+        # The user half-step of ALS for one user, against the fixed item factors
+        rows = self.item_index.get_indexer(new_user_df['Uid'].values)
+        known = rows >= 0
+        confidence = self.alpha * new_user_df['Review_Rating'].values[known].astype(np.float64)
+
+        Y = self.Vt[:, rows[known]].T.astype(np.float64)
+        A = self.gram + (Y.T * confidence).dot(Y) + self.regularization * np.eye(Y.shape[1])
+        return np.linalg.solve(A, Y.T.dot(1.0 + confidence)).astype(np.float32)
+
+
+def fit_cf_model(interaction_matrix, engine='svd', k=23, **als_options):
+    # Training engine behind CFRecommender: 'svd' (truncated SVD, zeros as ratings) or 'als' (weighted ALS)
+    if engine == 'svd':
+        return SVDModel.fit(interaction_matrix, k=k)
+    if engine == 'als':
+        return ALSModel.fit(interaction_matrix, k=k, **als_options)
+    raise ValueError('Unknown CF engine: %s (expected one of %s)' % (engine, ', '.join(CF_ENGINES)))
+
+
 class CFRecommender:
     MODEL_NAME = 'Collaborative Filtering'
 
-    def __init__(self, cf_predictions_df, items_df=None):
-        self.cf_predictions_df = cf_predictions_df
+    def __init__(self, svd_model, items_df=None, batcher=None, quantized=None, rerank=None, n_workers=None,
+                 genre_index=None):
+        self.svd_model = svd_model
+        self.item_ids = svd_model.item_ids
         self.items_df = items_df
+        # Optional MicroBatcher over predict_batch, shared by the recommenders of concurrent requests
+        self.batcher = batcher
+        # Optional Quantization.QuantizedMatrix of the item factors Vt.T, scanned instead of Vt; with rerank,
+        # the best `rerank` candidates are re-scored with the exact factors before the top-n is taken
+        self.quantized = quantized
+        self.rerank = rerank
+        # n_workers: recommend_items merges the partial top-n of that many worker processes, each scanning a
+        # shard of the exact item factors in shared memory (score_items stays in this process)
+        self.n_workers = n_workers
+        # Optional Genre_index.GenreIndex: recommend_items(genres=...) then only scores the rows of those genres
+        self.genre_index = genre_index.aligned(self.item_ids) if genre_index is not None else None
+        # Latent rows of users folded in after training, keyed by user id
+        self.new_user_vectors = {}
 
     def get_model_name(self):
         return self.MODEL_NAME
 
-    def recommend_items(self, user_id, items_to_ignore=[], topn=10, verbose=False):
-        # Get and sort the user's predictions
-        sorted_user_predictions = self.cf_predictions_df[user_id].sort_values(ascending=False) \
-            .reset_index().rename(columns={user_id: 'Review_Rating'})
+    def add_user(self, user_id, new_user_df):
+        self.new_user_vectors[user_id] = self.svd_model.fold_in(new_user_df)
+
+    def _user_vector(self, user_id):
+        if user_id in self.new_user_vectors:
+            return self.new_user_vectors[user_id]
+        return self.svd_model.user_vector(user_id)
+
+    def score_items(self, user_id):
+        # Computes only this user's row U[u] . diag(sigma) . Vt, aligned with self.item_ids
+        user_vector = self._user_vector(user_id)
+        if self.batcher is not None:
+            return self.batcher.score(user_vector)
+        return self.predict(user_vector)
+
+    def predict(self, user_vector):
+        if self.quantized is None:
+            return self.svd_model.predict(user_vector)
+        return self.svd_model.normalize_predictions(self.quantized.dot(user_vector))
+
+    def predict_batch(self, user_vectors):
+        if self.quantized is None:
+            return self.svd_model.predict_batch(user_vectors)
+        return self.svd_model.normalize_predictions(self.quantized.dot(np.vstack(user_vectors).T).T)
+
+    def _top_predictions(self, user_id, topn, ignore_mask, genres=None, genre_mode='any'):
+        if genres is not None:
+            # Genre prefilter: exact predictions of the candidate rows only
+            if self.genre_index is None:
+                raise ValueError('Filtering by genre needs a genre_index')
+            candidates = self.genre_index.mask(genres, genre_mode)
+            if ignore_mask is not None:
+                candidates &= ~ignore_mask
+            rows = np.flatnonzero(candidates)
+            predictions = self.svd_model.normalize_predictions(np.dot(self._user_vector(user_id),
+                                                                      self.svd_model.Vt[:, rows]))
+            best = top_k_indices(predictions, topn)
+            return rows[best], predictions[best]
 
-        # Recommend the highest predicted rating movies that the user hasn't seen yet.
-        recommendations_df = sorted_user_predictions[~sorted_user_predictions['Uid'].isin(items_to_ignore)] \
-            .sort_values('Review_Rating', ascending=False) \
-            .head(topn)
+        if self.n_workers:
+            # The normalization is increasing, so the top-n of the raw predictions is the top-n of the normalized
+            scorer = self.svd_model.sharded_scorer(self.n_workers)
+            top_indices, raw_predictions = scorer.top_k(self._user_vector(user_id), topn, ignore_mask)
+            return top_indices, self.svd_model.normalize_predictions(raw_predictions)
+
+        user_predictions = self.score_items(user_id)
+        if self.quantized is not None and self.rerank:
+            # Exact predictions of the shortlist of the quantized scan, which is then re-ordered by them
+            shortlist = top_k_indices(user_predictions, max(self.rerank, topn), ignore_mask)
+            exact = self.svd_model.normalize_predictions(np.dot(self._user_vector(user_id),
+                                                                self.svd_model.Vt[:, shortlist]))
+            best = top_k_indices(exact, topn)
+            return shortlist[best], exact[best]
+
+        top_indices = top_k_indices(user_predictions, topn, ignore_mask)
+        return top_indices, user_predictions[top_indices]
+
+    def recommend_items(self, user_id, items_to_ignore=[], topn=10, verbose=False, genres=None, genre_mode='any'):
+        # Recommend the highest predicted rating books that the user hasn't seen yet.
+        # genres: only recommend books of any ('any') or all ('all') of these genres
+        ignore_mask = build_ignore_mask(self.svd_model.item_index, items_to_ignore)
+        top_indices, top_predictions = self._top_predictions(user_id, topn, ignore_mask, genres, genre_mode)
+
+        recommendations_df = pd.DataFrame({'Uid': self.item_ids[top_indices],
+                                           'Review_Rating': top_predictions})
 
         if verbose:
             if self.items_df is None:
@@ -27,3 +278,4 @@ class CFRecommender:
                                                           right_on='Uid')[['Review_Rating', 'Uid', 'title']]
 
         return recommendations_df
+
@@ -1,98 +1,225 @@
 import pandas as pd
 import numpy as np
-import streamlit as st
-from scipy.sparse import load_npz
-from ast import literal_eval
 import scipy
+from threading import Lock
 from sklearn.preprocessing import normalize
-from sklearn.metrics.pairwise import cosine_similarity
-
-
-@st.cache_resource
-def load_data_google(sheets_url):
-    csv_url = sheets_url.replace("/edit#gid=", "/export?format=csv&gid=")
-    return pd.read_csv(csv_url)
-
-
-interactions_df = load_data_google(st.secrets['interactions_url'])
-books_selected = load_data_google(st.secrets['selected_books_url'])
-
-books_selected['Genres'] = books_selected['Genres'].apply(lambda x: literal_eval(x) if "[" in x else x)
-books_selected['Award'] = books_selected['Award'].apply(lambda x: literal_eval(x) if "[" in x else x)
-
-# tfidf_matrix = np.load('https://drive.google.com/file/d/1FB7nf2GC2X5O7ZfDwjlXKuU4fmvoM_Ij/')
-tfidf_matrix = load_npz("./pages/Datasets/tfidf_matrix.npz")
-item_ids = books_selected['Uid'].tolist()
-
-
-def get_item_profile(item_id):
-    idx = item_ids.index(item_id)
-    item_profile = tfidf_matrix[idx:idx + 1]
-    return item_profile
-
-
-def get_item_profiles(ids):
-    item_profiles_list = [get_item_profile(x) for x in ids]
-    item_profiles = scipy.sparse.vstack(item_profiles_list)
-    return item_profiles
-
-
-def build_users_profile(person_id, interactions_indexed_df):
-    interactions_person_df = interactions_indexed_df.loc[person_id]
-
-    if type(interactions_person_df['Uid']) == np.int64:
-        ids = []
-        ids.extend([interactions_person_df['Uid']])
+from Ranking import build_ignore_mask, top_k_indices, top_k_rows
+from Sharding import ShardedScorer
+
+
+class ItemProfiles:
+    # TF-IDF rows of the selected books together with the Uid -> row index used to look them up
+
+    def __init__(self, tfidf_matrix, item_ids, tfidf_matrix_norm=None, embeddings=None):
+        # embeddings: optional Embeddings.BookEmbeddings of the same rows. With it, user profiles are built and
+        # scored in that dense low-dimensional space, and tfidf_matrix / tfidf_matrix_norm hold its vectors
+        if embeddings is not None:
+            tfidf_matrix, tfidf_matrix_norm = embeddings.vectors, embeddings.vectors_norm
+        self.dense = not scipy.sparse.issparse(tfidf_matrix)
+        self.tfidf_matrix = tfidf_matrix if self.dense else tfidf_matrix.tocsr()
+        self.item_ids = np.asarray(item_ids)
+
+        # Uid -> row position of tfidf_matrix, built once so lookups are hash-based instead of list scans
+        self.item_index = pd.Index(self.item_ids)
+
+        # L2-normalized once at load, so cosine similarity against a unit-length profile is a plain dot product
+        if tfidf_matrix_norm is None:
+            tfidf_matrix_norm = normalize(self.tfidf_matrix, norm='l2', copy=True)
+        self.tfidf_matrix_norm = tfidf_matrix_norm if self.dense else tfidf_matrix_norm.tocsr()
+
+        # Process pools over shared-memory shards of tfidf_matrix_norm, one per worker count, see sharded_scorer
+        self.sharded_scorers = {}
+        self.scorer_lock = Lock()
+
+    def sharded_scorer(self, n_workers):
+        # Created on first use and shared by every recommender over these profiles
+        with self.scorer_lock:
+            if n_workers not in self.sharded_scorers:
+                self.sharded_scorers[n_workers] = ShardedScorer(self.tfidf_matrix_norm, n_workers)
+            return self.sharded_scorers[n_workers]
+
+    def get_item_rows(self, ids):
+        rows = self.item_index.get_indexer(np.asarray(ids).ravel())
+        if (rows < 0).any():
+            raise KeyError('Uid not found in books_selected: %s' % np.asarray(ids).ravel()[rows < 0][:5].tolist())
+        return rows
+
+    def get_item_profile(self, item_id):
+        idx = self.get_item_rows([item_id])[0]
+        item_profile = self.tfidf_matrix[idx:idx + 1]
+        return item_profile
+
+    def get_item_profiles(self, ids):
+        # Gather all rows with a single sparse fancy-index instead of stacking one-row slices
+        item_profiles = self.tfidf_matrix[self.get_item_rows(ids)]
+        return item_profiles
+
+    def user_item_weights(self, interactions_df, user_ids=None):
+        # Sparse (users x items) matrix of interaction strengths, built straight from the (UserID, Uid, rating) triples
+        rows = self.item_index.get_indexer(interactions_df['Uid'].values)
+        known = rows >= 0
+
+        if user_ids is None:
+            user_codes, user_ids = pd.factorize(interactions_df['UserID'].values[known])
+        else:
+            user_codes = pd.Index(user_ids).get_indexer(interactions_df['UserID'].values[known])
+        in_batch = user_codes >= 0
+
+        strengths = interactions_df['Review_Rating'].values[known][in_batch].astype(np.float64)
+        weights = scipy.sparse.csr_matrix((strengths, (user_codes[in_batch], rows[known][in_batch])),
+                                          shape=(len(user_ids), len(self.item_ids)))
+        return np.asarray(user_ids), weights
+
+
+def build_users_profile(person_id, interactions_indexed_df, item_profiles):
+    interactions_person_df = interactions_indexed_df.loc[[person_id]]
+
+    ids = interactions_person_df['Uid'].values
+    user_item_strengths = interactions_person_df['Review_Rating'].values.astype(np.float64)
+
+    # Weighted average of item profiles by the interactions strength, and normalized.
+    # The strengths vector times the gathered rows is one sparse (1 x n) . (n x d) product.
+    user_item_profiles = item_profiles.get_item_profiles(ids)
+    user_item_strengths_weighted_avg = scipy.sparse.csr_matrix(user_item_strengths.reshape(1, -1)) \
+        .dot(user_item_profiles) / np.sum(user_item_strengths)
+    user_profile_norm = normalize(user_item_strengths_weighted_avg)
 
-    else:
-        ids = interactions_person_df['Uid'].values
+    return user_profile_norm
 
 
-    user_item_profiles = get_item_profiles(ids)
-    user_item_strengths = np.array(interactions_person_df['Review_Rating']).reshape(-1, 1)
+def build_users_profile_matrix(interactions_df, item_profiles, user_ids=None):
+    user_ids, weights = item_profiles.user_item_weights(interactions_df, user_ids)
 
-    # Weighted average of item profiles by the interactions strength, and normalized
-    user_item_strengths_weighted_avg = np.sum(user_item_profiles.multiply(user_item_strengths), axis=0) / np.sum(
-        user_item_strengths)
-    user_profile_norm = normalize(user_item_strengths_weighted_avg)
+    # Weighted average of item profiles for every user at once; dividing by the strength sum only rescales a row,
+    # so the L2 normalization alone yields the same profile. Users without interactions keep an all-zero row.
+    user_profiles = normalize(weights.dot(item_profiles.tfidf_matrix))
 
-    return user_profile_norm
+    return user_ids, user_profiles
 
 
-def build_users_profiles(new_user_df):
-    interactions_indexed_df = new_user_df[new_user_df['Uid'].isin(books_selected['Uid'])].set_index('UserID')
+def build_users_profiles(new_user_df, item_profiles):
+    user_ids, user_profile_matrix = build_users_profile_matrix(new_user_df, item_profiles)
     user_profiles = {}
-    for person_id in interactions_indexed_df.index.unique():
-        user_profiles[person_id] = build_users_profile(person_id, interactions_indexed_df)
+    for i, person_id in enumerate(user_ids):
+        user_profiles[person_id] = user_profile_matrix[i]
     return user_profiles
 
 
 class ContentBasedRecommender:
     MODEL_NAME = 'Content-Based'
+    # Upper bound on the dense score block (users x items) plus dense profile block scored at once by recommend_batch
+    BATCH_MEMORY_BYTES = 256 * 1024 ** 2
 
-    def __init__(self, items_df=None):
-        self.item_ids = item_ids
+    def __init__(self, item_profiles, items_df=None, batcher=None, ann_index=None, n_probe=8, quantized=None,
+                 rerank=None, n_workers=None, genre_index=None):
+        self.item_profiles = item_profiles
+        self.item_ids = item_profiles.item_ids
         self.items_df = items_df
+        # Optional MicroBatcher over score_profiles, shared by the recommenders of concurrent requests
+        self.batcher = batcher
+        # Optional ANN.IVFIndex over tfidf_matrix_norm: recommend_items then only scores the items of the
+        # n_probe clusters closest to the profile instead of every item (score_items stays exhaustive)
+        self.ann_index = ann_index
+        self.n_probe = n_probe
+        # Optional Quantization.QuantizedMatrix of tfidf_matrix_norm, scanned instead of the full-precision rows;
+        # with rerank, the best `rerank` candidates are re-scored exactly before the top-n is taken
+        self.quantized = quantized
+        self.rerank = rerank
+        # n_workers: recommend_items merges the partial top-n of that many worker processes, each scanning a
+        # shard of the exact tfidf_matrix_norm in shared memory (score_items stays in this process)
+        self.n_workers = n_workers
+        # Optional Genre_index.GenreIndex: recommend_items(genres=...) then only scores the rows of those genres
+        self.genre_index = genre_index.aligned(self.item_ids) if genre_index is not None else None
 
     def get_model_name(self):
         return self.MODEL_NAME
 
-    def _get_similar_items_to_user_profile(self, person_id, new_user_profile, topn=1000):
+    @staticmethod
+    def _unit_profile(user_profile):
+        if scipy.sparse.issparse(user_profile):
+            user_profile = user_profile.toarray()
+        user_profile = np.asarray(user_profile, dtype=np.float64).ravel()
+        profile_norm = np.linalg.norm(user_profile)
+        if profile_norm > 0:
+            user_profile = user_profile / profile_norm
+        return user_profile
+
+    def score_items(self, user_id, user_profile):
+        # Cosine similarity between the user profile and every item profile, aligned with self.item_ids
+        user_profile = self._unit_profile(user_profile[user_id])
+        if self.batcher is not None:
+            return self.batcher.score(user_profile)
+
+        return self._score(user_profile)
+
+    def score_profiles(self, user_profiles):
+        # Batch form of score_items: one sparse x dense product for a list of profiles, one score row per profile
+        profiles = np.column_stack([self._unit_profile(user_profile) for user_profile in user_profiles])
+        return np.asarray(self._score(profiles)).T
+
+    def _score(self, profiles, rows=None):
+        # Item matrix (its quantized copy when set, the exact `rows` when given) times unit profile(s)
+        if self.quantized is not None and rows is None:
+            return self.quantized.dot(profiles)
+        item_matrix = self.item_profiles.tfidf_matrix_norm
+        if rows is not None:
+            item_matrix = item_matrix[rows]
+        # In the matrix dtype: a float64 profile against float32 embeddings would copy the whole matrix
+        return item_matrix.dot(profiles.astype(item_matrix.dtype, copy=False))
+
+    def _get_similar_items_to_user_profile(self, person_id, new_user_profile, topn=1000, items_to_ignore=None,
+                                           genres=None, genre_mode='any'):
+        # Ignores items the user has already interacted with as a mask, before the top-k selection
+        ignore_mask = build_ignore_mask(self.item_profiles.item_index, items_to_ignore)
+
+        if genres is not None:
+            # Genre prefilter: exact cosine similarities of the candidate rows only
+            if self.genre_index is None:
+                raise ValueError('Filtering by genre needs a genre_index')
+            candidates = self.genre_index.mask(genres, genre_mode)
+            if ignore_mask is not None:
+                candidates &= ~ignore_mask
+            rows = np.flatnonzero(candidates)
+            scores = np.asarray(self._score(self._unit_profile(new_user_profile[person_id]), rows)).ravel()
+            best = top_k_indices(scores, topn)
+            return self.item_ids[rows[best]], scores[best]
+
+        if self.ann_index is not None:
+            user_profile = new_user_profile[person_id]
+            user_profile = normalize(user_profile) if scipy.sparse.issparse(user_profile) \
+                else self._unit_profile(user_profile)
+            similar_indices, similar_scores = self.ann_index.search(user_profile, topn, self.n_probe, ignore_mask)
+            return self.item_ids[similar_indices], similar_scores
+
+        if self.n_workers:
+            scorer = self.item_profiles.sharded_scorer(self.n_workers)
+            similar_indices, similar_scores = scorer.top_k(self._unit_profile(new_user_profile[person_id]), topn,
+                                                           ignore_mask)
+            return self.item_ids[similar_indices], similar_scores
+
         # Computes the cosine similarity between the user profile and all item profiles
-        cosine_similarities = cosine_similarity(new_user_profile[person_id], tfidf_matrix)
+        cosine_similarities = self.score_items(person_id, new_user_profile)
 
-        # Gets the top similar items & sort by similarity
-        similar_indices = cosine_similarities.argsort().flatten()[-topn:]
-        similar_items = sorted([(item_ids[i], cosine_similarities[0, i]) for i in similar_indices], key=lambda x: -x[1])
+        if self.quantized is not None and self.rerank:
+            # Exact scores of the shortlist of the quantized scan, which is then re-ordered by them
+            shortlist = top_k_indices(cosine_similarities, max(self.rerank, topn), ignore_mask)
+            exact = np.asarray(self._score(self._unit_profile(new_user_profile[person_id]), shortlist)).ravel()
+            best = top_k_indices(exact, topn)
+            return self.item_ids[shortlist[best]], exact[best]
 
-        return similar_items
+        # Gets the top similar items, only the selected top-n are sorted
+        similar_indices = top_k_indices(cosine_similarities, topn, ignore_mask)
 
-    def recommend_items(self, user_id, user_profile, items_to_ignore=[], topn=10, verbose=False):
-        similar_items = self._get_similar_items_to_user_profile(user_id, user_profile)
-        # Ignores items the user has already interacted
-        similar_items_filtered = list(filter(lambda x: x[0] not in items_to_ignore, similar_items))
+        return self.item_ids[similar_indices], cosine_similarities[similar_indices]
 
-        recommendations_df = pd.DataFrame(similar_items_filtered, columns=['Uid', 'Review_Rating']).head(topn)
+    def recommend_items(self, user_id, user_profile, items_to_ignore=[], topn=10, verbose=False, genres=None,
+                        genre_mode='any'):
+        # genres: only recommend books of any ('any') or all ('all') of these genres
+        similar_ids, similar_scores = self._get_similar_items_to_user_profile(user_id, user_profile, topn=topn,
+                                                                              items_to_ignore=items_to_ignore,
+                                                                              genres=genres, genre_mode=genre_mode)
+
+        recommendations_df = pd.DataFrame({'Uid': similar_ids, 'Review_Rating': similar_scores})
 
         # If verbose is set to True, then the method returns a DataFrame that includes additional information
         # about the recommended items, such as their title, URL, and language.
@@ -105,3 +232,48 @@ class ContentBasedRecommender:
                                                           right_on='Uid')[['Review_Rating', 'Uid', 'Title']]
 
         return recommendations_df
+
+    def recommend_batch(self, user_ids, interactions_df, topn=10, ignore_interacted=True, chunk_size=None):
+        # Scores many users against the item matrix with one sparse matrix product per chunk of users.
+        # Returns (len(user_ids) x topn) arrays of Uids and cosine scores; rows with fewer than topn
+        # candidates are padded with Uid -1 and a NaN score, and so are the rows of users without a profile
+        # (no interactions with a known book).
+        user_ids, weights = self.item_profiles.user_item_weights(interactions_df, user_ids)
+        item_matrix = self.item_profiles.tfidf_matrix_norm
+        # Profiles in the item matrix dtype, so the products do not upcast a float32 item matrix chunk by chunk
+        user_profiles = normalize(weights.dot(self.item_profiles.tfidf_matrix)).astype(item_matrix.dtype, copy=False)
+        has_profile = np.asarray(abs(user_profiles).sum(axis=1)).ravel() > 0
+        n_users, (n_items, n_terms) = len(user_ids), item_matrix.shape
+
+        # A chunk of sparse profiles is scored as item_matrix . (dense profile block): the sparse x dense product
+        # writes the dense scores directly, with no sparse (users x items) intermediate, so a user costs its
+        # score row plus its dense profile column
+        row_bytes = item_matrix.dtype.itemsize * (n_items if self.item_profiles.dense else n_items + n_terms)
+        if chunk_size is None:
+            chunk_size = max(1, self.BATCH_MEMORY_BYTES // row_bytes)
+
+        rec_ids = np.full((n_users, topn), -1, dtype=self.item_ids.dtype)
+        rec_scores = np.full((n_users, topn), np.nan, dtype=np.float32)
+
+        for start in range(0, n_users, chunk_size):
+            stop = min(start + chunk_size, n_users)
+            if self.item_profiles.dense:
+                scores = np.asarray(user_profiles[start:stop].dot(item_matrix.T))
+            else:
+                # (items x users) in C order, used through its transpose
+                scores = np.asarray(item_matrix.dot(user_profiles[start:stop].T.toarray())).T
+
+            if ignore_interacted:
+                ignore_users, ignore_items = weights[start:stop].nonzero()
+                scores[ignore_users, ignore_items] = -np.inf
+            scores[~has_profile[start:stop]] = -np.inf
+
+            top_indices = top_k_rows(scores, topn)
+            top_scores = np.take_along_axis(scores, top_indices, axis=1)
+            valid = np.isfinite(top_scores)
+
+            k = top_indices.shape[1]
+            rec_ids[start:stop, :k] = np.where(valid, self.item_ids[top_indices], -1)
+            rec_scores[start:stop, :k] = np.where(valid, top_scores, np.nan)
+
+        return rec_ids, rec_scores
@@ -0,0 +1,179 @@
+import argparse
+import os
+import time
+from ast import literal_eval
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+# Dataset name -> secrets key of its Google Sheets link
+DATASETS = {'info': 'info_url',
+            'selected_books': 'selected_books_url',
+            'interactions': 'interactions_url',
+            'book_tags': 'book_tags_url',
+            'book_summary': 'book_summary_url',
+            'book_pic_url': 'book_pic_url',
+            'stats': 'stats_url'}
+SNAPSHOT_DIR = './pages/Datasets/snapshots'
+SNAPSHOT_SUFFIX = '.feather'
+# Text columns stored as datetime64 when every value parses as a date
+DATE_COLUMNS = ('Review_Date', 'date')
+# List-valued columns ("['fiction', 'art']" cells), also stored parsed next to the snapshot of their dataset
+LIST_COLUMNS = {'info': ('Full_Genres', 'Award'),
+                'selected_books': ('Genres', 'Award')}
+
+
+class ListColumn:
+    # A list-valued column parsed once: the values of row i are vocabulary[codes[offsets[i]:offsets[i + 1]]].
+    # The vocabulary is sorted, so codes compare like the values themselves.
+
+    def __init__(self, offsets, codes, vocabulary):
+        self.offsets = np.asarray(offsets)
+        self.codes = np.asarray(codes)
+        self.vocabulary = np.asarray(vocabulary)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def parse(cls, values):
+        # A cell without '[' is a one-value list, an empty cell an empty one
+        cells = [literal_eval(cell) if '[' in cell else [cell] for cell in pd.Series(values).fillna('[]').astype(str)]
+        lengths = np.fromiter((len(cell) for cell in cells), dtype=np.int64, count=len(cells))
+        vocabulary, codes = np.unique(np.array([value for cell in cells for value in cell], dtype=str),
+                                      return_inverse=True)
+        return cls(np.concatenate([[0], np.cumsum(lengths)]), codes.astype(np.int32), vocabulary)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(arrays['offsets'], arrays['codes'], arrays['vocabulary'])
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, offsets=self.offsets, codes=self.codes, vocabulary=self.vocabulary)
+        os.replace(path + '.tmp', path)
+
+    def take(self, rows):
+        # The same column over a subset / reordering of the rows
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return ListColumn(offsets, self.codes[positions], self.vocabulary)
+
+    def indicator(self):
+        # (rows x vocabulary) CSR matrix, 1 where the value is in the row's list
+        rows = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        matrix = csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, self.codes)),
+                            shape=(len(self), len(self.vocabulary)))
+        matrix.data[:] = 1
+        return matrix
+
+
+def read_table(source, columns=None):
+    # Local CSV path or a Google Sheets '/edit#gid=' link
+    return pd.read_csv(source.replace("/edit#gid=", "/export?format=csv&gid="), usecols=columns)
+
+
+def dataset_sources(secrets_path):
+    # Dataset name -> sheet link from a secrets.toml, empty when the file does not exist
+    if not os.path.exists(secrets_path):
+        return {}
+    import toml
+    secrets = toml.load(secrets_path)
+    return {name: secrets[key] for name, key in DATASETS.items() if key in secrets}
+
+
+def snapshot_path(name, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, name + SNAPSHOT_SUFFIX)
+
+
+def list_column_path(name, column, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, '%s.%s.npz' % (name, column))
+
+
+def typed_columns(df):
+    # Integer ids / counts as int32 when they fit, date columns as datetime64; text and floats are kept as is
+    df = df.copy()
+    int32 = np.iinfo(np.int32)
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_integer_dtype(values) and len(values) and \
+                int32.min <= values.min() and values.max() <= int32.max:
+            df[column] = values.astype(np.int32)
+        elif column in DATE_COLUMNS and not pd.api.types.is_datetime64_any_dtype(values):
+            try:
+                df[column] = pd.to_datetime(values)
+            except (ValueError, TypeError):
+                pass
+    return df
+
+
+def export_snapshot(name, df, snapshot_dir=SNAPSHOT_DIR):
+    # Written next to the final file and renamed, so a reader never sees half a snapshot. The list columns
+    # keep their text in the snapshot for display and are parsed here, once, into <name>.<column>.npz
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for column in LIST_COLUMNS.get(name, ()):
+        if column in df.columns:
+            ListColumn.parse(df[column]).save(list_column_path(name, column, snapshot_dir))
+    path = snapshot_path(name, snapshot_dir)
+    typed_columns(df).reset_index(drop=True).to_feather(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load_dataset(name, source=None, columns=None, snapshot_dir=SNAPSHOT_DIR):
+    # Reads only `columns` from the local Feather snapshot when it exists, otherwise parses the CSV / sheet at source
+    if name not in DATASETS:
+        raise ValueError('Unknown dataset: %s (expected one of %s)' % (name, ', '.join(DATASETS)))
+    path = snapshot_path(name, snapshot_dir)
+    if os.path.exists(path):
+        return pd.read_feather(path, columns=columns)
+    if source is None:
+        raise FileNotFoundError('No snapshot at %s and no source given for dataset %s' % (path, name))
+    return read_table(source, columns)
+
+
+def load_list_column(name, column, source=None, snapshot_dir=SNAPSHOT_DIR):
+    # Parsed list column of a dataset, rows in dataset order; parsed from the text only when it was not exported
+    path = list_column_path(name, column, snapshot_dir)
+    if os.path.exists(path):
+        return ListColumn.load(path)
+    return ListColumn.parse(load_dataset(name, source, [column], snapshot_dir)[column])
+
+
+if __name__ == '__main__':
+    # Export the sheets to local snapshots, run from Module_3, e.g.:
+    # python Models/Datasets.py --out ./pages/Datasets/snapshots
+    # python Models/Datasets.py --source interactions=interactions.csv --source selected_books=books.csv
+    parser = argparse.ArgumentParser(description='Export the app datasets to local Feather snapshots')
+    parser.add_argument('--out', default=SNAPSHOT_DIR)
+    parser.add_argument('--secrets', default='./.streamlit/secrets.toml')
+    parser.add_argument('--source', action='append', default=[], metavar='NAME=PATH',
+                        help='CSV path or sheet URL of one dataset, overrides the link in secrets')
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), default=None,
+                        help='datasets to export, default every dataset with a source')
+    args = parser.parse_args()
+
+    sources = dataset_sources(args.secrets)
+    for override in args.source:
+        name, _, source = override.partition('=')
+        if name not in DATASETS:
+            parser.error('Unknown dataset: %s' % name)
+        sources[name] = source
+
+    for name in args.datasets or [name for name in DATASETS if name in sources]:
+        if name not in sources:
+            parser.error('No source for dataset %s' % name)
+        start = time.perf_counter()
+        df = read_table(sources[name])
+        parse_seconds = time.perf_counter() - start
+
+        path = export_snapshot(name, df, args.out)
+        start = time.perf_counter()
+        pd.read_feather(path)
+        load_seconds = time.perf_counter() - start
+        print('%s: %d rows, %d columns, %.1f MB -> %s (CSV %.3fs, snapshot %.3fs)'
+              % (name, len(df), df.shape[1], os.path.getsize(path) / 1024 ** 2, path, parse_seconds, load_seconds))
@@ -0,0 +1,108 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import load_npz
+from sklearn.preprocessing import normalize
+from sklearn.utils.extmath import randomized_svd
+
+from Content_based import ContentBasedRecommender, ItemProfiles, build_users_profiles
+from Evaluation import latency_summary
+
+
+class BookEmbeddings:
+    # Dense LSA vectors of the books: the TF-IDF rows projected on their top `dim` singular directions,
+    # X ~ U . diag(sigma) . Vt, vectors = U . diag(sigma). The projection is linear, so a rating-weighted sum of
+    # these vectors is the projection of the same sum of TF-IDF rows, and profiles can be built in either space.
+    # vectors_norm are the unit-length rows used for cosine scoring. Both are contiguous float32.
+
+    def __init__(self, vectors, vectors_norm=None):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors_norm is None:
+            vectors_norm = normalize(self.vectors)
+        self.vectors_norm = np.ascontiguousarray(vectors_norm, dtype=np.float32)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + self.vectors_norm.nbytes
+
+    @classmethod
+    def fit(cls, tfidf_matrix, dim=128, n_iter=5, seed=42):
+        dim = min(dim, min(tfidf_matrix.shape) - 1)
+        U, sigma, _ = randomized_svd(tfidf_matrix.astype(np.float32), dim, n_iter=n_iter, random_state=seed)
+        return cls(U * sigma)
+
+
+def sparse_nbytes(matrix):
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def compare_spaces(tfidf_matrix, item_ids, interactions_df, dims=(32, 64, 128, 256), k=10, max_users=200, seed=42):
+    # Memory, per-request latency and ranking agreement of the embedding spaces against the TF-IDF space:
+    # overlap@k is the share of the TF-IDF top-k (rated books excluded) that the embedding space also returns
+    interactions_df = interactions_df[interactions_df['Uid'].isin(item_ids)]
+    user_ids = pd.Series(interactions_df['UserID'].unique()).sample(
+        min(max_users, interactions_df['UserID'].nunique()), random_state=seed)
+    histories = [group[['Uid', 'UserID', 'Review_Rating']]
+                 for _, group in interactions_df[interactions_df['UserID'].isin(user_ids)].groupby('UserID')]
+
+    def run(item_profiles):
+        model = ContentBasedRecommender(item_profiles)
+        rankings, latencies = [], []
+        for history in histories:
+            user_id = history['UserID'].iloc[0]
+            start = time.perf_counter()
+            user_profile = build_users_profiles(history, item_profiles)
+            ranking = model.recommend_items(user_id, user_profile, items_to_ignore=history['Uid'].values, topn=k)
+            latencies.append(time.perf_counter() - start)
+            rankings.append(set(ranking['Uid'].tolist()))
+        return rankings, latency_summary(latencies)
+
+    tfidf_profiles = ItemProfiles(tfidf_matrix, item_ids)
+    exact_rankings, exact_latency = run(tfidf_profiles)
+    report = {'users': len(histories), 'k': k,
+              'tfidf': {'shape': list(tfidf_profiles.tfidf_matrix_norm.shape),
+                        'memory_mb': (sparse_nbytes(tfidf_profiles.tfidf_matrix) +
+                                      sparse_nbytes(tfidf_profiles.tfidf_matrix_norm)) / 1024 ** 2,
+                        'latency_ms': exact_latency},
+              'embeddings': []}
+
+    for dim in dims:
+        start = time.perf_counter()
+        embeddings = BookEmbeddings.fit(tfidf_matrix, dim=dim, seed=seed)
+        fit_seconds = time.perf_counter() - start
+        rankings, latency = run(ItemProfiles(None, item_ids, embeddings=embeddings))
+        overlap = np.mean([len(a & b) / max(len(a), 1) for a, b in zip(exact_rankings, rankings)])
+        report['embeddings'].append({'dim': embeddings.dim, 'memory_mb': embeddings.nbytes / 1024 ** 2,
+                                     'fit_seconds': fit_seconds, 'latency_ms': latency,
+                                     'overlap@%d' % k: float(overlap)})
+    return report
+
+
+if __name__ == '__main__':
+    # Run from Module_3, e.g.:
+    # python Models/Embeddings.py --books books.csv --interactions interactions.csv --dims 64 128
+    parser = argparse.ArgumentParser(description='Memory, latency and ranking change of LSA book embeddings')
+    parser.add_argument('--tfidf', default='./pages/Datasets/tfidf_matrix.npz')
+    parser.add_argument('--books', required=True, help='CSV of the selected books (row order of the TF-IDF matrix)')
+    parser.add_argument('--interactions', required=True, help='CSV with Uid, UserID, Review_Rating')
+    parser.add_argument('--dims', type=int, nargs='+', default=[32, 64, 128, 256])
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--max-users', type=int, default=200)
+    parser.add_argument('--out', default=None, help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = compare_spaces(load_npz(args.tfidf), pd.read_csv(args.books)['Uid'].values,
+                            pd.read_csv(args.interactions), dims=tuple(args.dims), k=args.k, max_users=args.max_users)
+
+    report_json = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report_json)
+    else:
+        print(report_json)
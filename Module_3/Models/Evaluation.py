@@ -0,0 +1,228 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy.sparse import load_npz
+
+from Interactions import InteractionMatrix
+from Popularity import PopularityRecommender
+from Content_based import ContentBasedRecommender, ItemProfiles, build_users_profiles
+from Collaborative_Filtering import CF_ENGINES, CFRecommender, fit_cf_model
+from Hybrid import HybridRecommender, ItemAlignment
+from Item_based import ItemCFRecommender, ItemNeighbors
+
+MODEL_NAMES = ('Popularity', 'Content-Based', 'Collaborative Filtering', 'Hybrid', 'Item-based CF')
+
+
+def leave_k_out_split(interactions_df, k=1, seed=42):
+    # Holds out k random interactions of every user with more than k of them
+    shuffled = interactions_df.sample(frac=1.0, random_state=seed)
+    position = shuffled.groupby('UserID').cumcount()
+    counts = shuffled.groupby('UserID')['Uid'].transform('size')
+    is_test = (position < k) & (counts > k)
+    return shuffled[~is_test], shuffled[is_test]
+
+
+def time_split(interactions_df, time_col='Review_Date', test_fraction=0.2):
+    # Holds out the latest test_fraction of interactions; test users without training history are dropped
+    timestamps = pd.to_datetime(interactions_df[time_col])
+    cutoff = timestamps.quantile(1.0 - test_fraction)
+    train_df, test_df = interactions_df[timestamps <= cutoff], interactions_df[timestamps > cutoff]
+    return train_df, test_df[test_df['UserID'].isin(train_df['UserID'])]
+
+
+def recall_at_k(recommended, relevant, k):
+    return len(set(recommended[:k]) & relevant) / len(relevant)
+
+
+def ndcg_at_k(recommended, relevant, k):
+    gains = np.array([1.0 if uid in relevant else 0.0 for uid in recommended[:k]])
+    dcg = np.sum(gains / np.log2(np.arange(2, len(gains) + 2)))
+    idcg = np.sum(1.0 / np.log2(np.arange(2, min(len(relevant), k) + 2)))
+    return dcg / idcg
+
+
+def latency_summary(latencies):
+    latencies_ms = np.asarray(latencies) * 1000.0
+    return {'mean': float(latencies_ms.mean()),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p90': float(np.percentile(latencies_ms, 90)),
+            'p99': float(np.percentile(latencies_ms, 99)),
+            'max': float(latencies_ms.max())}
+
+
+def evaluate_model(recommend, test_df, catalog_size, ks=(5, 10), memory_sample_users=50):
+    # recommend(user_id) -> ranked list of Uids. Every call is timed; the Python / NumPy heap peak is measured
+    # with tracemalloc in a separate pass over a sample of users, so tracing does not inflate the latencies.
+    relevant_items = test_df.groupby('UserID')['Uid'].apply(set)
+    topn = max(ks)
+
+    metrics = {'recall@%d' % k: [] for k in ks}
+    metrics.update({'ndcg@%d' % k: [] for k in ks})
+    recommended_items = set()
+    latencies = []
+
+    for user_id, relevant in relevant_items.items():
+        start = time.perf_counter()
+        recommended = list(recommend(user_id))[:topn]
+        latencies.append(time.perf_counter() - start)
+
+        recommended_items.update(recommended)
+        for k in ks:
+            metrics['recall@%d' % k].append(recall_at_k(recommended, relevant, k))
+            metrics['ndcg@%d' % k].append(ndcg_at_k(recommended, relevant, k))
+
+    tracemalloc.start()
+    for user_id in relevant_items.index[:memory_sample_users]:
+        recommend(user_id)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results = {name: float(np.mean(values)) for name, values in metrics.items()}
+    results['coverage'] = len(recommended_items) / catalog_size
+    results['users'] = len(relevant_items)
+    results['latency_ms'] = latency_summary(latencies)
+    results['peak_memory_mb'] = peak_memory / 1024 ** 2
+    return results
+
+
+def build_models(train_df, books_df, tfidf_matrix, k=23, cf_engine='svd', n_workers=None):
+    # Fits all the recommenders on the training interactions, timing each build
+    build_seconds = {}
+
+    start = time.perf_counter()
+    interaction_matrix = InteractionMatrix.from_df(train_df[['Uid', 'UserID', 'Review_Rating']])
+    popularity_model = PopularityRecommender(interaction_matrix.item_popularity(), books_df)
+    build_seconds['Popularity'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    item_profiles = ItemProfiles(tfidf_matrix, books_df['Uid'].values)
+    cb_model = ContentBasedRecommender(item_profiles, books_df, n_workers=n_workers)
+    build_seconds['Content-Based'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    svd_model = fit_cf_model(interaction_matrix, cf_engine, k=k)
+    build_seconds['Collaborative Filtering'] = time.perf_counter() - start
+
+    # The hybrid reuses both sub-models; its own build is the shared item index
+    start = time.perf_counter()
+    item_alignment = ItemAlignment(cb_model.item_ids, svd_model.item_ids)
+    build_seconds['Hybrid'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    item_neighbors = ItemNeighbors.build(interaction_matrix)
+    build_seconds['Item-based CF'] = time.perf_counter() - start
+
+    return popularity_model, cb_model, svd_model, item_alignment, item_neighbors, build_seconds
+
+
+def run_benchmark(interactions_df, books_df, tfidf_matrix, split='leave-k-out', holdout=1, ks=(5, 10),
+                  max_users=None, k=23, seed=42, models=MODEL_NAMES, cf_engine='svd', n_workers=None):
+    # n_workers: content-based and CF requests are scored by that many processes over shared-memory shards
+    interactions_df = interactions_df[interactions_df['Uid'].isin(books_df['Uid'])]
+    if split == 'time':
+        train_df, test_df = time_split(interactions_df)
+    else:
+        train_df, test_df = leave_k_out_split(interactions_df, k=holdout, seed=seed)
+
+    if max_users is not None:
+        test_users = pd.Series(test_df['UserID'].unique()).sample(min(max_users, test_df['UserID'].nunique()),
+                                                                  random_state=seed)
+        test_df = test_df[test_df['UserID'].isin(test_users)]
+
+    popularity_model, cb_model, svd_model, item_alignment, item_neighbors, build_seconds = \
+        build_models(train_df, books_df, tfidf_matrix, k=k, cf_engine=cf_engine, n_workers=n_workers)
+    train_by_user = train_df.groupby('UserID')
+    topn = max(ks)
+
+    # Each request mirrors the app: the user's training ratings are the known input, which are both
+    # ignored in the output and used to build the profile / fold the user into the SVD model
+    def user_history(user_id):
+        return train_by_user.get_group(user_id)[['Uid', 'UserID', 'Review_Rating']]
+
+    def recommend_popularity(user_id):
+        history = user_history(user_id)
+        return popularity_model.recommend_items(items_to_ignore=history['Uid'].values, topn=topn)['Uid']
+
+    def recommend_content_based(user_id):
+        history = user_history(user_id)
+        user_profile = build_users_profiles(history, cb_model.item_profiles)
+        return cb_model.recommend_items(user_id, user_profile, items_to_ignore=history['Uid'].values,
+                                        topn=topn)['Uid']
+
+    def recommend_cf(user_id):
+        history = user_history(user_id)
+        cf_model = CFRecommender(svd_model, books_df, n_workers=n_workers)
+        cf_model.add_user(user_id, history)
+        return cf_model.recommend_items(user_id, items_to_ignore=history['Uid'].values, topn=topn)['Uid']
+
+    def recommend_hybrid(user_id):
+        history = user_history(user_id)
+        user_profile = build_users_profiles(history, cb_model.item_profiles)
+        cf_model = CFRecommender(svd_model, books_df)
+        cf_model.add_user(user_id, history)
+        hybrid_model = HybridRecommender(cb_model, cf_model, books_df, item_alignment=item_alignment)
+        return hybrid_model.recommend_items(user_id, user_profile, items_to_ignore=history['Uid'].values,
+                                            topn=topn)['Uid']
+
+    def recommend_item_cf(user_id):
+        history = user_history(user_id)
+        item_cf_model = ItemCFRecommender(item_neighbors, books_df)
+        item_cf_model.add_user(user_id, history)
+        return item_cf_model.recommend_items(user_id, items_to_ignore=history['Uid'].values, topn=topn)['Uid']
+
+    recommenders = {'Popularity': recommend_popularity,
+                    'Content-Based': recommend_content_based,
+                    'Collaborative Filtering': recommend_cf,
+                    'Hybrid': recommend_hybrid,
+                    'Item-based CF': recommend_item_cf}
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                              'pandas': pd.__version__, 'machine': platform.machine()},
+              'config': {'split': split, 'holdout': holdout, 'ks': list(ks), 'max_users': max_users, 'svd_k': k,
+                         'cf_engine': cf_engine, 'n_workers': n_workers, 'seed': seed,
+                         'train_interactions': len(train_df), 'test_interactions': len(test_df),
+                         'catalog_size': len(books_df)},
+              'models': {}}
+
+    for name in models:
+        results = evaluate_model(recommenders[name], test_df, len(books_df), ks=ks)
+        results['build_seconds'] = build_seconds[name]
+        report['models'][name] = results
+
+    return report
+
+
+if __name__ == '__main__':
+    # Run from Module_3, e.g.:
+    # python Models/Evaluation.py --interactions interactions.csv --books books.csv --out benchmark.json
+    parser = argparse.ArgumentParser(description='Offline accuracy and latency benchmark of the recommenders')
+    parser.add_argument('--interactions', required=True, help='CSV with Uid, UserID, Review_Rating')
+    parser.add_argument('--books', required=True, help='CSV of the selected books (row order of the TF-IDF matrix)')
+    parser.add_argument('--tfidf', default='./pages/Datasets/tfidf_matrix.npz')
+    parser.add_argument('--split', choices=['leave-k-out', 'time'], default='leave-k-out')
+    parser.add_argument('--holdout', type=int, default=1, help='interactions held out per user (leave-k-out)')
+    parser.add_argument('--ks', type=int, nargs='+', default=[5, 10])
+    parser.add_argument('--max-users', type=int, default=None)
+    parser.add_argument('--svd-k', type=int, default=23)
+    parser.add_argument('--cf-engine', choices=CF_ENGINES, default='svd')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='score content-based and CF requests with this many processes')
+    parser.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=list(MODEL_NAMES))
+    parser.add_argument('--out', default=None, help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run_benchmark(pd.read_csv(args.interactions), pd.read_csv(args.books), load_npz(args.tfidf),
+                           split=args.split, holdout=args.holdout, ks=tuple(args.ks), max_users=args.max_users,
+                           k=args.svd_k, models=args.models, cf_engine=args.cf_engine, n_workers=args.workers)
+
+    report_json = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report_json)
+    else:
+        print(report_json)
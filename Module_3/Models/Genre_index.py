@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+GENRE_MODES = ('any', 'all')
+
+
+class GenreIndex:
+    # Inverted index genre -> item rows, one bitmap per genre over the rows of item_ids (bit j of genre g is set
+    # when item_ids[j] belongs to g), packed 8 rows per byte as np.packbits does. A multi-genre query is one
+    # bitwise OR ('any', union) or AND ('all', intersection) over n_items / 8 bytes per genre, and unpacks into
+    # the boolean row mask the scorers use as a prefilter.
+
+    def __init__(self, genres, bitmaps, item_ids):
+        self.genres = list(genres)
+        self.genre_positions = {genre: i for i, genre in enumerate(self.genres)}
+        self.bitmaps = bitmaps
+        self.item_ids = np.asarray(item_ids)
+        self.item_index = pd.Index(self.item_ids)
+
+    @classmethod
+    def build(cls, item_ids, item_genres_df):
+        # item_genres_df: one (Uid, Genre) row per membership, like GenreLeaderboards.build; Uids outside item_ids
+        # are skipped. The bits are set in place, without an unpacked (genres x items) table.
+        rows = pd.Index(item_ids).get_indexer(item_genres_df['Uid'].values)
+        known = rows >= 0
+        genre_codes, genres = pd.factorize(item_genres_df['Genre'].values[known])
+        rows = rows[known]
+
+        bitmaps = np.zeros((len(genres), (len(item_ids) + 7) // 8), dtype=np.uint8)
+        np.bitwise_or.at(bitmaps, (genre_codes, rows >> 3), (0x80 >> (rows & 7)).astype(np.uint8))
+        return cls(genres, bitmaps, item_ids)
+
+    def bitmap(self, genres, mode='any'):
+        # Packed bitmap of the rows in any / all of genres; a genre the index does not know matches no row
+        if mode not in GENRE_MODES:
+            raise ValueError('Unknown genre mode: %s (expected one of %s)' % (mode, ', '.join(GENRE_MODES)))
+        genres = set(genres)
+        positions = [self.genre_positions[genre] for genre in genres if genre in self.genre_positions]
+        if not positions or (mode == 'all' and len(positions) < len(genres)):
+            return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+        combine = np.bitwise_or if mode == 'any' else np.bitwise_and
+        return combine.reduce(self.bitmaps[positions], axis=0)
+
+    def mask(self, genres, mode='any'):
+        return np.unpackbits(self.bitmap(genres, mode), count=len(self.item_ids)).view(bool)
+
+    def rows(self, genres, mode='any'):
+        # Sorted item rows of the query
+        return np.flatnonzero(self.mask(genres, mode))
+
+    def aligned(self, item_ids):
+        # This index over another item order, e.g. the CF item ids; items it does not know have no genre
+        item_ids = np.asarray(item_ids)
+        if np.array_equal(item_ids, self.item_ids):
+            return self
+        rows = self.item_index.get_indexer(item_ids)
+        known = np.flatnonzero(rows >= 0)
+        members = np.zeros((len(self.genres), len(item_ids)), dtype=bool)
+        members[:, known] = np.unpackbits(self.bitmaps, axis=1, count=len(self.item_ids)).view(bool)[:, rows[known]]
+        return GenreIndex(self.genres, np.packbits(members, axis=1), item_ids)
@@ -1,38 +1,143 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+from threading import Lock
+from Ranking import build_ignore_mask, reciprocal_rank_fusion, top_k_indices
+
+# Thread pool shared by every HybridRecommender running its sub-models in parallel. The sub-models spend
+# their time in NumPy / SciPy kernels that release the GIL, so threads overlap the two branches.
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor(max_workers=4):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hybrid')
+    return _executor
+
+
+class ItemAlignment:
+    # Shared item index for the two sub-models: content-based items first, then the CF-only items.
+    # cb_positions / cf_positions map each sub-model's score vector onto the shared index.
+
+    def __init__(self, cb_item_ids, cf_item_ids):
+        cb_item_ids = np.asarray(cb_item_ids)
+        cf_item_ids = np.asarray(cf_item_ids)
+        cf_only = cf_item_ids[pd.Index(cb_item_ids).get_indexer(cf_item_ids) < 0]
+
+        self.item_ids = np.concatenate([cb_item_ids, cf_only])
+        self.item_index = pd.Index(self.item_ids)
+        self.cb_positions = np.arange(len(cb_item_ids))
+        self.cf_positions = self.item_index.get_indexer(cf_item_ids)
+
+
 class HybridRecommender:
     MODEL_NAME = 'Hybrid'
 
-    def __init__(self, cb_rec_model, cf_rec_model, items_df, cb_ensemble_weight=1.0, cf_ensemble_weight=1.0):
+    def __init__(self, cb_rec_model, cf_rec_model, items_df, cb_ensemble_weight=1.0, cf_ensemble_weight=1.0,
+                 item_alignment=None, parallel=False, timeout=None, executor=None, fusion='weighted', rrf_k=60):
         self.cb_rec_model = cb_rec_model
         self.cf_rec_model = cf_rec_model
         self.cb_ensemble_weight = cb_ensemble_weight  # weight of content-based filtering
         self.cf_ensemble_weight = cf_ensemble_weight  # weight of collaborative filtering
         self.items_df = items_df
 
+        # The alignment only depends on the two item catalogs, so callers can build it once and share it
+        if item_alignment is None:
+            item_alignment = ItemAlignment(cb_rec_model.item_ids, cf_rec_model.item_ids)
+        self.item_alignment = item_alignment
+
+        # parallel: score both sub-models at once on the shared pool; timeout: per-request deadline in seconds
+        self.parallel = parallel
+        self.timeout = timeout
+        self.executor = executor
+
+        # fusion: 'weighted' sums the full score vectors, 'rrf' is reciprocal-rank fusion with constant rrf_k
+        if fusion not in ('weighted', 'rrf'):
+            raise ValueError('Unknown fusion mode: %s' % fusion)
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+
     def get_model_name(self):
         return self.MODEL_NAME
 
-    def recommend_items(self, user_id, user_profile, items_to_ignore=[], topn=10, verbose=False):
-        # Getting the top-1000 Content-based filtering recommendations
-        cb_recs_df = self.cb_rec_model.recommend_items(user_id, user_profile=user_profile,
-                                                       items_to_ignore=items_to_ignore, verbose=verbose,
-                                                       topn=1000).rename(columns={'Review_Rating': 'Rating_CB'})
+    def _score_sub_models_parallel(self, user_id, user_profile):
+        # Runs both sub-models on the pool and waits until the deadline. A branch that misses it is
+        # returned as None so the hybrid falls back to the other branch; if both miss, TimeoutError is raised.
+        executor = self.executor or get_executor()
+        cb_future = executor.submit(self.cb_rec_model.score_items, user_id, user_profile)
+        cf_future = executor.submit(self.cf_rec_model.score_items, user_id)
+
+        done, not_done = wait([cb_future, cf_future], timeout=self.timeout)
+        if not done:
+            raise TimeoutError('Neither hybrid sub-model finished within %s seconds' % self.timeout)
+        for future in not_done:
+            future.cancel()
+
+        cb_item_scores = cb_future.result() if cb_future in done else None
+        cf_item_scores = cf_future.result() if cf_future in done else None
+        return cb_item_scores, cf_item_scores
+
+    def _genre_mask(self, genres, genre_mode):
+        # Rows of the shared index in the genres, from the genre indexes of the two sub-models
+        alignment = self.item_alignment
+        mask = np.zeros(len(alignment.item_ids), dtype=bool)
+        for model, positions in ((self.cb_rec_model, alignment.cb_positions),
+                                 (self.cf_rec_model, alignment.cf_positions)):
+            if model.genre_index is None:
+                raise ValueError('Filtering by genre needs a genre_index on both sub-models')
+            mask[positions] |= model.genre_index.mask(genres, genre_mode)
+        return mask
+
+    def recommend_items(self, user_id, user_profile, items_to_ignore=[], topn=10, verbose=False, genres=None,
+                        genre_mode='any'):
+        # genres: only recommend books of any ('any') or all ('all') of these genres
+        alignment = self.item_alignment
+
+        # Full score vectors of both sub-models, scattered onto the shared item index.
+        # An item unknown to one sub-model gets 0 from it, as the outer merge with fillna(0.0) did.
+        if self.parallel:
+            cb_item_scores, cf_item_scores = self._score_sub_models_parallel(user_id, user_profile)
+        else:
+            cb_item_scores = self.cb_rec_model.score_items(user_id, user_profile)
+            cf_item_scores = self.cf_rec_model.score_items(user_id)
 
-        # Getting the top-1000 Collaborative filtering recommendations
-        cf_recs_df = self.cf_rec_model.recommend_items(user_id, items_to_ignore=items_to_ignore, verbose=verbose,
-                                                       topn=1000).rename(columns={'Review_Rating': 'Rating_CF'})
+        cb_scores = np.zeros(len(alignment.item_ids))
+        if cb_item_scores is not None:
+            cb_scores[alignment.cb_positions] = cb_item_scores
+        cf_scores = np.zeros(len(alignment.item_ids))
+        if cf_item_scores is not None:
+            cf_scores[alignment.cf_positions] = cf_item_scores
 
-        # Combining the results by Uid
-        recs_df = cb_recs_df.merge(cf_recs_df,
-                                   how='outer',
-                                   left_on='Uid',
-                                   right_on='Uid').fillna(0.0)
+        # Masking the items to ignore, then selecting the top-n by hybrid score
+        ignore_mask = build_ignore_mask(alignment.item_index, items_to_ignore)
+        if genres is not None:
+            outside_genres = ~self._genre_mask(genres, genre_mode)
+            ignore_mask = outside_genres if ignore_mask is None else ignore_mask | outside_genres
 
-        # Computing a hybrid recommendation score based on CF and CB scores
-        recs_df['Rating_Hybrid'] = (recs_df['Rating_CB'] * self.cb_ensemble_weight) \
-                                   + (recs_df['Rating_CF'] * self.cf_ensemble_weight)
+        if self.fusion == 'rrf':
+            # Only the branches that returned are ranked; a dropped branch would otherwise rank items by index
+            score_vectors, weights = [], []
+            if cb_item_scores is not None:
+                score_vectors.append(cb_scores)
+                weights.append(self.cb_ensemble_weight)
+            if cf_item_scores is not None:
+                score_vectors.append(cf_scores)
+                weights.append(self.cf_ensemble_weight)
+            top_indices, top_scores = reciprocal_rank_fusion(score_vectors, weights, topn, ignore_mask,
+                                                             rrf_k=self.rrf_k)
+        else:
+            # Computing a hybrid recommendation score based on CF and CB scores
+            hybrid_scores = (cb_scores * self.cb_ensemble_weight) + (cf_scores * self.cf_ensemble_weight)
+            top_indices = top_k_indices(hybrid_scores, topn, ignore_mask)
+            top_scores = hybrid_scores[top_indices]
 
-        # Sorting recommendations by hybrid score
-        recommendations_df = recs_df.sort_values('Rating_Hybrid', ascending=False).head(topn)
+        recommendations_df = pd.DataFrame({'Uid': alignment.item_ids[top_indices],
+                                           'Rating_CB': cb_scores[top_indices],
+                                           'Rating_CF': cf_scores[top_indices],
+                                           'Rating_Hybrid': top_scores})
 
         if verbose:
             if self.items_df is None:
@@ -42,4 +147,4 @@ class HybridRecommender:
                                                           left_on='Uid',
                                                           right_on='Uid')[['Rating_Hybrid', 'Uid', 'Title']]
 
-        return recommendations_df
\ No newline at end of file
+        return recommendations_df
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+class InteractionMatrix:
+    def __init__(self, matrix, user_ids, item_ids):
+        self.matrix = matrix
+        self.user_ids = np.asarray(user_ids)
+        self.item_ids = np.asarray(item_ids)
+        # code <-> id mappings: row / column position in matrix <-> UserID / Uid
+        self.user_index = pd.Index(self.user_ids)
+        self.item_index = pd.Index(self.item_ids)
+
+    @classmethod
+    def from_df(cls, interactions_df):
+        # Builds the (users x items) CSR matrix straight from the (UserID, Uid, Review_Rating) triples,
+        # without a dense pivot table. A repeated (UserID, Uid) pair keeps its last rating.
+        interactions_df = interactions_df.drop_duplicates(['UserID', 'Uid'], keep='last')
+
+        # sort=True keeps the same row / column order as the pivot table used before
+        user_codes, user_ids = pd.factorize(interactions_df['UserID'], sort=True)
+        item_codes, item_ids = pd.factorize(interactions_df['Uid'], sort=True)
+        ratings = interactions_df['Review_Rating'].to_numpy(dtype=np.float32)
+
+        matrix = csr_matrix((ratings, (user_codes.astype(np.int32), item_codes.astype(np.int32))),
+                            shape=(len(user_ids), len(item_ids)))
+
+        return cls(matrix, user_ids, item_ids)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def item_popularity(self):
+        # Sum of ratings per book over the matrix, i.e. with one rating per (UserID, Uid) pair: the same score
+        # as groupby('Uid')['Review_Rating'].sum() after from_df dropped the repeated pairs (keeping the last)
+        popularity = np.asarray(self.matrix.sum(axis=0)).ravel()
+        return pd.DataFrame({'Uid': self.item_ids, 'Review_Rating': popularity}) \
+            .sort_values('Review_Rating', ascending=False).reset_index(drop=True)
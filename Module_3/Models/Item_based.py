@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+from Ranking import build_ignore_mask, top_k_indices, top_k_rows
+
+
+class ItemNeighbors:
+    # Top-N most similar books of every book, as a sparse (items x items) matrix whose row j holds the
+    # cosine similarities of book j to its neighbors. Built offline; scoring only gathers rows of it.
+
+    # Upper bound on the dense (block x items) similarity block computed at once by build()
+    BLOCK_MEMORY_BYTES = 256 * 1024 ** 2
+
+    def __init__(self, neighbors, item_ids):
+        self.neighbors = neighbors.tocsr()
+        self.item_ids = np.asarray(item_ids)
+        self.item_index = pd.Index(self.item_ids)
+
+    @classmethod
+    def build(cls, interaction_matrix, n_neighbors=50, block_size=None):
+        # Cosine similarity between the items' rating columns, one block of items at a time so the dense
+        # similarities never exceed BLOCK_MEMORY_BYTES; only the n_neighbors best positive ones per item are kept
+        item_users = normalize(interaction_matrix.matrix.T.tocsr().astype(np.float32))
+        n_items = item_users.shape[0]
+        if block_size is None:
+            block_size = max(1, cls.BLOCK_MEMORY_BYTES // (4 * max(n_items, 1)))
+
+        users_items = item_users.T.tocsr()
+        rows, cols, sims = [], [], []
+        for start in range(0, n_items, block_size):
+            stop = min(start + block_size, n_items)
+            block = item_users[start:stop].dot(users_items).toarray()
+            block[np.arange(stop - start), np.arange(start, stop)] = 0.0  # an item is not its own neighbor
+
+            top = top_k_rows(block, n_neighbors)
+            top_sims = np.take_along_axis(block, top, axis=1)
+            keep = top_sims > 0
+            rows.append(np.nonzero(keep)[0] + start)
+            cols.append(top[keep])
+            sims.append(top_sims[keep])
+
+        neighbors = csr_matrix((np.concatenate(sims).astype(np.float32),
+                                (np.concatenate(rows), np.concatenate(cols))), shape=(n_items, n_items))
+        return cls(neighbors, interaction_matrix.item_ids)
+
+    def score(self, new_user_df):
+        # Rating-weighted sum of the neighbor rows of the rated books, divided by the rating sum so scores stay
+        # in [0, 1]; books never listed as a neighbor of a rated book score 0
+        rows = self.item_index.get_indexer(new_user_df['Uid'].values)
+        known = rows >= 0
+        ratings = new_user_df['Review_Rating'].values[known].astype(np.float32)
+        if not known.any():
+            return np.zeros(len(self.item_ids), dtype=np.float32)
+
+        scores = self.neighbors[rows[known]].T.dot(ratings)
+        return scores / ratings.sum()
+
+
+class ItemCFRecommender:
+    MODEL_NAME = 'Item-based Collaborative Filtering'
+
+    def __init__(self, item_neighbors, items_df=None, genre_index=None):
+        self.item_neighbors = item_neighbors
+        self.item_ids = item_neighbors.item_ids
+        self.items_df = items_df
+        # Optional Genre_index.GenreIndex, aligned with the neighbor rows for genre queries
+        self.genre_index = genre_index.aligned(self.item_ids) if genre_index is not None else None
+        # Ratings of the users added at request time, keyed by user id
+        self.new_user_ratings = {}
+
+    def get_model_name(self):
+        return self.MODEL_NAME
+
+    def add_user(self, user_id, new_user_df):
+        self.new_user_ratings[user_id] = new_user_df[['Uid', 'Review_Rating']]
+
+    def score_items(self, user_id):
+        # Aligned with self.item_ids, like CFRecommender.score_items
+        return self.item_neighbors.score(self.new_user_ratings[user_id])
+
+    def recommend_items(self, user_id, items_to_ignore=[], topn=10, verbose=False, genres=None, genre_mode='any'):
+        # genres: only recommend books of any ('any') or all ('all') of these genres
+        user_predictions = self.score_items(user_id)
+
+        # Recommend the books closest to the user's rated ones that the user hasn't seen yet.
+        ignore_mask = build_ignore_mask(self.item_neighbors.item_index, items_to_ignore)
+
+        if genres is not None:
+            if self.genre_index is None:
+                raise ValueError('Filtering by genre needs a genre_index')
+            candidates = self.genre_index.mask(genres, genre_mode)
+            if ignore_mask is not None:
+                candidates &= ~ignore_mask
+            rows = np.flatnonzero(candidates)
+            top_indices = rows[top_k_indices(user_predictions[rows], topn)]
+        else:
+            top_indices = top_k_indices(user_predictions, topn, ignore_mask)
+        recommendations_df = pd.DataFrame({'Uid': self.item_ids[top_indices],
+                                           'Review_Rating': user_predictions[top_indices]})
+
+        if verbose:
+            if self.items_df is None:
+                raise Exception('"items_df" is required in verbose mode')
+
+            recommendations_df = recommendations_df.merge(self.items_df, how='left',
+                                                          left_on='Uid',
+                                                          right_on='Uid')[['Review_Rating', 'Uid', 'Title']]
+
+        return recommendations_df
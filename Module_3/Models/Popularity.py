@@ -1,18 +1,183 @@
+import heapq
+from threading import Lock
+import numpy as np
+import pandas as pd
+from Ranking import top_k_indices
+
+
+class GenreLeaderboards:
+    # Popularity tables precomputed once per genre. Genre i's leaderboard is uids[offsets[i]:offsets[i + 1]],
+    # sorted by descending popularity score; books without interactions sit at the end with a score of 0.
+
+    def __init__(self, genres, offsets, uids, scores):
+        self.genres = list(genres)
+        self.genre_positions = {genre: i for i, genre in enumerate(self.genres)}
+        self.offsets = np.asarray(offsets)
+
+        # Current score of every book on any leaderboard, used by update()
+        unique_uids, first = np.unique(np.asarray(uids), return_index=True)
+        item_scores = pd.Series(np.asarray(scores)[first], index=unique_uids)
+
+        # update() builds new arrays and swaps this tuple in one assignment, so a top() running on another
+        # thread reads one consistent version; updates themselves are serialized by update_lock
+        self.state = (uids, scores, item_scores)
+        self.update_lock = Lock()
+
+    @property
+    def uids(self):
+        return self.state[0]
+
+    @property
+    def scores(self):
+        return self.state[1]
+
+    @property
+    def item_scores(self):
+        return self.state[2]
+
+    @classmethod
+    def build(cls, item_popularity_df, item_genres_df):
+        # item_popularity_df: Uid / Review_Rating score per book; item_genres_df: one (Uid, Genre) row per membership
+        members = item_genres_df[['Uid', 'Genre']].drop_duplicates()
+        item_scores = item_popularity_df.set_index('Uid')['Review_Rating']
+        scores = item_scores.reindex(members['Uid'].values).fillna(0).to_numpy(dtype=np.float64)
+
+        genre_codes, genres = pd.factorize(members['Genre'])
+        order = np.lexsort((-scores, genre_codes))
+        offsets = np.searchsorted(genre_codes[order], np.arange(len(genres) + 1))
+
+        return cls(genres, offsets, members['Uid'].to_numpy()[order], scores[order])
+
+    def leaderboard(self, genre, state=None):
+        uids, scores, _ = state or self.state
+        i = self.genre_positions[genre]
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return uids[start:stop], scores[start:stop]
+
+    def top(self, genres, topn=10, items_to_ignore=()):
+        # Merges the selected genres' leaderboards heap-style and stops after topn distinct books. Only the first
+        # topn + len(ignore) entries of each leaderboard are read: a leaderboard holds distinct books, so once that
+        # prefix is used up, topn of its books have been taken or are duplicates of taken ones (at most len(ignore)
+        # are skipped), and the merge has already stopped. The cost depends on topn, the number of genres and the
+        # ignored books, not on the size of the genres.
+        state = self.state
+        ignore = set(np.asarray(items_to_ignore).ravel().tolist())
+        depth = topn + len(ignore)
+        streams = []
+        for genre in genres:
+            if genre in self.genre_positions:
+                uids, scores = self.leaderboard(genre, state)
+                streams.append(zip((-scores[:depth]).tolist(), uids[:depth].tolist()))
+
+        top_uids, top_scores = [], []
+        for neg_score, uid in heapq.merge(*streams):
+            if len(top_uids) >= topn or neg_score >= 0:
+                break
+            if uid in ignore:
+                continue
+            # A book listed under several selected genres is only recommended once
+            ignore.add(uid)
+            top_uids.append(uid)
+            top_scores.append(-neg_score)
+
+        return top_uids, top_scores
+
+    def update(self, new_interactions_df):
+        # Adds new interactions to the scores and re-sorts only the leaderboards of the genres they touch,
+        # on copies (memory-mapped leaderboards are read-only)
+        score_delta = new_interactions_df.groupby('Uid')['Review_Rating'].sum()
+        with self.update_lock:
+            uids, scores, item_scores = self.state
+            score_delta = score_delta[score_delta.index.isin(item_scores.index)]
+            if score_delta.empty:
+                return
+            item_scores = item_scores.copy()
+            item_scores.loc[score_delta.index] += score_delta.values
+            uids, scores = np.array(uids), np.array(scores)
+
+            touched_positions = np.flatnonzero(np.isin(uids, score_delta.index.values))
+            for i in np.unique(np.searchsorted(self.offsets, touched_positions, side='right') - 1):
+                start, stop = self.offsets[i], self.offsets[i + 1]
+                board_scores = item_scores.reindex(uids[start:stop]).to_numpy()
+                order = np.argsort(-board_scores, kind='stable')
+                uids[start:stop] = uids[start:stop][order]
+                scores[start:stop] = board_scores[order]
+            self.state = (uids, scores, item_scores)
+
+
 class PopularityRecommender:
     MODEL_NAME = 'Popularity'
 
-    def __init__(self, popularity_df, items_df=None):
-        self.popularity_df = popularity_df
+    def __init__(self, popularity_df, items_df=None, leaderboards=None, genre_index=None):
+        # popularity_df (Uid, Review_Rating) ranks the requests without genres, so every configuration needs it
+        if popularity_df is None:
+            raise ValueError('PopularityRecommender needs popularity_df, the (Uid, Review_Rating) popularity table')
         self.items_df = items_df
+        self.leaderboards = leaderboards
+
+        # Optional Genre_index.GenreIndex, used for genre intersections ('all') or when there are no leaderboards:
+        # the popularity scores are aligned with its rows once, and a query only ranks the rows of its genres
+        self.genre_index = genre_index
+        self._set_popularity(popularity_df)
+        self.update_lock = Lock()
 
     def get_model_name(self):
         return self.MODEL_NAME
 
-    def recommend_items(self, items_to_ignore=[], topn=10, verbose=False):
-        # Recommend the more popular items that the user hasn't seen yet.
-        recommendations_df = self.popularity_df[~self.popularity_df['Uid'].isin(items_to_ignore)] \
-            .sort_values('Review_Rating', ascending=False) \
-            .head(topn)
+    @property
+    def popularity_df(self):
+        return self.state[0]
+
+    @property
+    def item_scores(self):
+        return self.state[1]
+
+    def _set_popularity(self, popularity_df):
+        # popularity_df and the scores aligned with the genre index are swapped in as one tuple
+        item_scores = None
+        if self.genre_index is not None:
+            item_scores = popularity_df.set_index('Uid')['Review_Rating'] \
+                .reindex(self.genre_index.item_ids).fillna(0).to_numpy(dtype=np.float64)
+        self.state = (popularity_df, item_scores)
+
+    def update(self, new_interactions_df):
+        # Adds new interactions (Uid, Review_Rating) to the popularity scores of every path: the overall table,
+        # the scores the genre index ranks and the genre leaderboards
+        with self.update_lock:
+            if self.leaderboards is not None:
+                self.leaderboards.update(new_interactions_df)
+            score_delta = new_interactions_df.groupby('Uid')['Review_Rating'].sum().astype(np.float64)
+            scores = self.popularity_df.set_index('Uid')['Review_Rating'].add(score_delta, fill_value=0)
+            scores = scores.sort_values(ascending=False, kind='stable')
+            self._set_popularity(pd.DataFrame({'Uid': scores.index.values, 'Review_Rating': scores.values}))
+
+    def _top_by_genre_index(self, item_scores, genres, genre_mode, items_to_ignore, topn):
+        # Books without interactions are left out, as on the leaderboards
+        candidates = self.genre_index.mask(genres, genre_mode) & (item_scores > 0)
+        ignore_rows = self.genre_index.item_index.get_indexer(np.asarray(items_to_ignore).ravel())
+        candidates[ignore_rows[ignore_rows >= 0]] = False
+        rows = np.flatnonzero(candidates)
+        best = rows[top_k_indices(item_scores[rows], topn)]
+        return self.genre_index.item_ids[best], item_scores[best]
+
+    def recommend_items(self, items_to_ignore=[], topn=10, verbose=False, genres=None, genre_mode='any'):
+        # genres: only recommend books of any ('any') or all ('all') of these genres
+        popularity_df, item_scores = self.state
+        use_genre_index = item_scores is not None and (genre_mode == 'all' or self.leaderboards is None)
+        if genres is not None and use_genre_index:
+            top_uids, top_scores = self._top_by_genre_index(item_scores, genres, genre_mode, items_to_ignore, topn)
+            recommendations_df = pd.DataFrame({'Uid': top_uids, 'Review_Rating': top_scores})
+        elif genres is not None and genre_mode == 'all':
+            raise ValueError('Genre intersections need a genre_index')
+        elif genres is not None and self.leaderboards is not None:
+            # Recommend from the precomputed leaderboards of the selected genres
+            top_uids, top_scores = self.leaderboards.top(genres, topn=topn, items_to_ignore=items_to_ignore)
+            recommendations_df = pd.DataFrame({'Uid': top_uids, 'Review_Rating': top_scores})
+        else:
+            # Recommend the more popular items that the user hasn't seen yet.
+            recommendations_df = popularity_df[~popularity_df['Uid'].isin(items_to_ignore)] \
+                .sort_values('Review_Rating', ascending=False) \
+                .head(topn)
 
         if verbose:
             if self.items_df is None:
@@ -21,4 +186,4 @@ class PopularityRecommender:
             recommendations_df = recommendations_df.merge(self.items_df, how='left',
                                                           left_on='Uid', right_on='Uid')[['Review_Rating', 'Uid', 'Title']]
 
-        return recommendations_df
\ No newline at end of file
+        return recommendations_df
@@ -0,0 +1,190 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, issparse, load_npz
+
+from Interactions import InteractionMatrix
+from Collaborative_Filtering import CFRecommender, SVDModel
+from Content_based import ContentBasedRecommender, ItemProfiles, build_users_profile_matrix
+from Evaluation import latency_summary
+
+QUANTIZED_DTYPES = ('int8', 'float16')
+
+
+class QuantizedMatrix:
+    # Compressed copy of an (items x d) matrix, dense or CSR: every row is stored as int8 or float16 codes
+    # times one float32 scale per row (int8: max |value| / 127, float16: max |value|, so codes stay in [-1, 1]).
+    # dot() decompresses a block of rows at a time into a float32 buffer that stays in cache, so a scan reads
+    # 1 (int8) or 2 (float16) bytes per value from memory instead of 4 or 8.
+
+    # Rows decompressed at once by dot()
+    BLOCK_ROWS = 4096
+
+    def __init__(self, codes, scales, shape, indices=None, indptr=None):
+        # codes: (items x d) array for a dense matrix, the CSR data array when indices / indptr are given
+        self.codes = codes
+        self.scales = np.asarray(scales, dtype=np.float32)
+        self.shape = tuple(shape)
+        self.indices = indices
+        self.indptr = indptr
+
+    @property
+    def sparse(self):
+        return self.indptr is not None
+
+    @property
+    def nbytes(self):
+        nbytes = self.codes.nbytes + self.scales.nbytes
+        if self.sparse:
+            nbytes += self.indices.nbytes + self.indptr.nbytes
+        return nbytes
+
+    @classmethod
+    def quantize(cls, matrix, dtype='int8'):
+        if dtype not in QUANTIZED_DTYPES:
+            raise ValueError('Unknown quantized dtype: %s (expected one of %s)' % (dtype, ', '.join(QUANTIZED_DTYPES)))
+        levels = 127.0 if dtype == 'int8' else 1.0
+
+        def encode(scaled):
+            return np.rint(scaled).astype(np.int8) if dtype == 'int8' else scaled.astype(np.float16)
+
+        if issparse(matrix):
+            matrix = matrix.tocsr()
+            values = np.abs(np.asarray(matrix.data, dtype=np.float32))
+            row_nnz = np.diff(matrix.indptr)
+            max_abs = np.zeros(matrix.shape[0], dtype=np.float32)
+            if len(values):
+                max_abs[row_nnz > 0] = np.maximum.reduceat(values, matrix.indptr[:-1][row_nnz > 0])
+            scales = np.where(max_abs > 0, max_abs / levels, 1.0).astype(np.float32)
+            codes = encode(matrix.data.astype(np.float32) / np.repeat(scales, row_nnz))
+            return cls(codes, scales, matrix.shape, matrix.indices.copy(), matrix.indptr.copy())
+
+        values = np.asarray(matrix, dtype=np.float32)
+        max_abs = np.abs(values).max(axis=1, initial=0.0)
+        scales = np.where(max_abs > 0, max_abs / levels, 1.0).astype(np.float32)
+        return cls(np.ascontiguousarray(encode(values / scales[:, None])), scales, matrix.shape)
+
+    def _block(self, start, stop):
+        # Rows start..stop-1 decompressed to float32, without the scales
+        if not self.sparse:
+            return self.codes[start:stop].astype(np.float32)
+        lo, hi = self.indptr[start], self.indptr[stop]
+        return csr_matrix((self.codes[lo:hi].astype(np.float32), self.indices[lo:hi],
+                           self.indptr[start:stop + 1] - lo), shape=(stop - start, self.shape[1]))
+
+    def dot(self, x):
+        # matrix . x for a vector (d,) or a (d x n) matrix, in float32
+        x = np.asarray(x, dtype=np.float32)
+        out = np.empty((self.shape[0],) + x.shape[1:], dtype=np.float32)
+        for start in range(0, self.shape[0], self.BLOCK_ROWS):
+            stop = min(start + self.BLOCK_ROWS, self.shape[0])
+            out[start:stop] = np.asarray(self._block(start, stop).dot(x))
+        scales = self.scales if x.ndim == 1 else self.scales[:, None]
+        return out * scales
+
+    def dequantize(self):
+        if self.sparse:
+            row_scales = np.repeat(self.scales, np.diff(self.indptr))
+            return csr_matrix((self.codes.astype(np.float32) * row_scales, self.indices, self.indptr),
+                              shape=self.shape)
+        return self.codes.astype(np.float32) * self.scales[:, None]
+
+
+def matrix_nbytes(matrix):
+    if issparse(matrix):
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    return matrix.nbytes
+
+
+def ranking_agreement(exact_rankings, rankings):
+    # Mean overlap@k of two lists of top-k Uid arrays, and the share of users whose top-k is identical in order
+    overlaps = [len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(exact_rankings, rankings)]
+    identical = [np.array_equal(a, b) for a, b in zip(exact_rankings, rankings)]
+    return float(np.mean(overlaps)), float(np.mean(identical))
+
+
+def compare_quantization(item_profiles, svd_model, interactions_df, dtypes=QUANTIZED_DTYPES, rerank=100, k=10,
+                         max_users=200, seed=42):
+    # Memory of the content-based and CF item matrices in each storage mode, per-request latency, and the
+    # agreement of the top-k with the full-precision one, with and without the exact re-rank of a shortlist
+    interactions_df = interactions_df[interactions_df['Uid'].isin(item_profiles.item_ids) &
+                                      interactions_df['Uid'].isin(svd_model.item_ids)]
+    user_ids = pd.Series(interactions_df['UserID'].unique()).sample(
+        min(max_users, interactions_df['UserID'].nunique()), random_state=seed).values
+    histories = [group[['Uid', 'UserID', 'Review_Rating']]
+                 for _, group in interactions_df[interactions_df['UserID'].isin(user_ids)].groupby('UserID')]
+    user_ids, profiles = build_users_profile_matrix(interactions_df, item_profiles, user_ids=user_ids)
+    profile_rows = pd.Index(user_ids)
+
+    def run_cb(quantized=None, rerank=None):
+        model = ContentBasedRecommender(item_profiles, quantized=quantized, rerank=rerank)
+        rankings, latencies = [], []
+        for history in histories:
+            user_id = history['UserID'].iloc[0]
+            user_profile = {user_id: profiles[profile_rows.get_loc(user_id)]}
+            start = time.perf_counter()
+            ranking = model.recommend_items(user_id, user_profile, items_to_ignore=history['Uid'].values, topn=k)
+            latencies.append(time.perf_counter() - start)
+            rankings.append(ranking['Uid'].values)
+        return rankings, latency_summary(latencies)
+
+    def run_cf(quantized=None, rerank=None):
+        model = CFRecommender(svd_model, quantized=quantized, rerank=rerank)
+        rankings, latencies = [], []
+        for history in histories:
+            user_id = history['UserID'].iloc[0]
+            model.add_user(user_id, history)
+            start = time.perf_counter()
+            ranking = model.recommend_items(user_id, items_to_ignore=history['Uid'].values, topn=k)
+            latencies.append(time.perf_counter() - start)
+            rankings.append(ranking['Uid'].values)
+        return rankings, latency_summary(latencies)
+
+    report = {'users': len(histories), 'k': k, 'rerank': rerank}
+    for name, run, matrix in (('content-based', run_cb, item_profiles.tfidf_matrix_norm),
+                              ('collaborative-filtering', run_cf, svd_model.Vt.T)):
+        exact_rankings, exact_latency = run()
+        section = {'full': {'dtype': str(matrix.dtype), 'memory_mb': matrix_nbytes(matrix) / 1024 ** 2,
+                            'latency_ms': exact_latency},
+                   'quantized': []}
+        for dtype in dtypes:
+            quantized = QuantizedMatrix.quantize(matrix, dtype)
+            entry = {'dtype': dtype, 'memory_mb': quantized.nbytes / 1024 ** 2,
+                     'memory_saved': 1.0 - quantized.nbytes / matrix_nbytes(matrix)}
+            for label, shortlist in (('no_rerank', None), ('rerank', rerank)):
+                rankings, latency = run(quantized, shortlist)
+                overlap, identical = ranking_agreement(exact_rankings, rankings)
+                entry[label] = {'latency_ms': latency, 'overlap@%d' % k: overlap, 'identical_order': identical}
+            section['quantized'].append(entry)
+        report[name] = section
+    return report
+
+
+if __name__ == '__main__':
+    # Run from Module_3, e.g.:
+    # python Models/Quantization.py --books books.csv --interactions interactions.csv --out quantization.json
+    parser = argparse.ArgumentParser(description='Memory saved and ranking agreement of quantized item matrices')
+    parser.add_argument('--tfidf', default='./pages/Datasets/tfidf_matrix.npz')
+    parser.add_argument('--books', required=True, help='CSV of the selected books (row order of the TF-IDF matrix)')
+    parser.add_argument('--interactions', required=True, help='CSV with Uid, UserID, Review_Rating')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--svd-k', type=int, default=23)
+    parser.add_argument('--rerank', type=int, default=100, help='shortlist re-ranked with the full-precision rows')
+    parser.add_argument('--max-users', type=int, default=200)
+    parser.add_argument('--out', default=None, help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    interactions_df = pd.read_csv(args.interactions)
+    item_profiles = ItemProfiles(load_npz(args.tfidf), pd.read_csv(args.books)['Uid'].values)
+    interaction_matrix = InteractionMatrix.from_df(interactions_df[['Uid', 'UserID', 'Review_Rating']])
+    report = compare_quantization(item_profiles, SVDModel.fit(interaction_matrix, k=args.svd_k), interactions_df,
+                                  rerank=args.rerank, k=args.k, max_users=args.max_users)
+
+    report_json = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report_json)
+    else:
+        print(report_json)
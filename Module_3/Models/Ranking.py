@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def top_k_indices(scores, k, mask=None):
+    # Indices of the k highest scores, sorted by descending score.
+    # Rows where mask is True are excluded before selection.
+    scores = np.asarray(scores).ravel()
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if mask is not None:
+        candidates = np.flatnonzero(~mask)
+        if k < len(candidates):
+            part = np.argpartition(-scores[candidates], k - 1)[:k]
+            candidates = candidates[part]
+    else:
+        candidates = np.arange(len(scores))
+        if k < len(candidates):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+
+    # Only the (at most k) selected candidates are fully sorted
+    order = np.argsort(-scores[candidates], kind='stable')
+    return candidates[order]
+
+
+def top_k_rows(scores, k):
+    # Row-wise version of top_k_indices for a 2-D (users x items) score block
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
+    if k < n_cols:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n_cols), (n_rows, 1))
+
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def build_ignore_mask(item_index, items_to_ignore):
+    # Boolean row mask over item_index marking the Uids in items_to_ignore (None when there is nothing to ignore)
+    if items_to_ignore is None or len(items_to_ignore) == 0:
+        return None
+    ignore_rows = item_index.get_indexer(np.asarray(items_to_ignore).ravel())
+    ignore_mask = np.zeros(len(item_index), dtype=bool)
+    ignore_mask[ignore_rows[ignore_rows >= 0]] = True
+    return ignore_mask
+
+
+def reciprocal_rank_fusion(score_vectors, weights, k, mask=None, rrf_k=60):
+    # Exact top-k of  sum_i weights[i] / (rrf_k + rank_i), rank_i the 1-based rank of an item in score_vectors[i]
+    # among the items not masked out. One stable argsort per vector; ties keep index order.
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    n = len(np.asarray(score_vectors[0]).ravel())
+    candidates = np.arange(n) if mask is None else np.flatnonzero(~mask)
+
+    fused = np.zeros(len(candidates))
+    ranks = np.empty(len(candidates))
+    for w, scores in zip(weights, score_vectors):
+        order = np.argsort(-np.asarray(scores).ravel()[candidates], kind='stable')
+        ranks[order] = np.arange(1, len(candidates) + 1)
+        fused += w / (rrf_k + ranks)
+
+    top = top_k_indices(fused, k)
+    return candidates[top], fused[top]
@@ -0,0 +1,535 @@
+import argparse
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Timer
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import Request, urlopen
+import numpy as np
+import pandas as pd
+
+from Popularity import PopularityRecommender
+from Content_based import ContentBasedRecommender, build_users_profiles
+from Collaborative_Filtering import CFRecommender
+from Item_based import ItemCFRecommender
+from Hybrid import HybridRecommender, ItemAlignment
+from Batching import MicroBatcher
+from Quantization import QUANTIZED_DTYPES, QuantizedMatrix, matrix_nbytes
+from Cache import RecommendationCache, request_key
+from Genre_index import GENRE_MODES
+from Artifacts import current_version, load_artifacts
+from Evaluation import latency_summary
+
+MODELS = ('popularity', 'content-based', 'collaborative-filtering', 'hybrid', 'item-based')
+# UserID given to the ratings of a request, the same one the app has always used for its new user
+NEW_USER_ID = 13223456
+
+
+class LatencyStats:
+    # Per-endpoint request counters and the latencies of the last `window` requests
+
+    def __init__(self, window=10000):
+        self.window = window
+        self.lock = Lock()
+        self.latencies = {}
+        self.counts = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, error=False):
+        with self.lock:
+            if endpoint not in self.latencies:
+                self.latencies[endpoint] = deque(maxlen=self.window)
+                self.counts[endpoint] = 0
+                self.errors[endpoint] = 0
+            self.latencies[endpoint].append(seconds)
+            self.counts[endpoint] += 1
+            self.errors[endpoint] += int(error)
+
+    def summary(self):
+        with self.lock:
+            return {endpoint: {'requests': self.counts[endpoint], 'errors': self.errors[endpoint],
+                               'latency_ms': latency_summary(list(latencies))}
+                    for endpoint, latencies in self.latencies.items()}
+
+
+class ServingModels:
+    # One consistent set of models; a request keeps the set it started with even if the service reloads
+
+    def __init__(self, item_profiles, svd_model, genre_leaderboards=None, popularity_df=None, items_df=None,
+                 version=None, batching=False, max_batch_size=32, max_wait_ms=2.0, ann_index=None, n_probe=None,
+                 quantization=None, rerank=100, scoring_processes=None, genre_index=None, request_timeout=None,
+                 item_neighbors=None):
+        self.item_profiles = item_profiles
+        self.svd_model = svd_model
+        # item_neighbors: Item_based.ItemNeighbors of the item-based model, None when the build has none
+        self.item_neighbors = item_neighbors
+        self.items_df = items_df
+        self.version = version
+        # genre_index: genre queries of every model are prefiltered by it (aligned once with each item order)
+        self.genre_index = genre_index
+        self.popularity_model = PopularityRecommender(popularity_df, items_df, leaderboards=genre_leaderboards,
+                                                      genre_index=genre_index)
+        # quantization ('int8' / 'float16'): CB and CF scan compressed copies of their item matrices, and
+        # re-rank the best `rerank` candidates with the full-precision rows (rerank=None keeps the approximate order)
+        self.cb_quantized = self.cf_quantized = None
+        if quantization:
+            self.cb_quantized = QuantizedMatrix.quantize(item_profiles.tfidf_matrix_norm, quantization)
+            self.cf_quantized = QuantizedMatrix.quantize(svd_model.Vt.T, quantization)
+        self.quantization = quantization
+        # scoring_processes: CB / CF top-n lists are merged from that many worker processes, see Sharding.py
+        self.cf_options = {'quantized': self.cf_quantized, 'rerank': rerank, 'n_workers': scoring_processes,
+                           'genre_index': genre_index.aligned(svd_model.item_ids) if genre_index is not None else None}
+        # n_probe: content-based requests search the IVF index instead of scanning every item
+        self.cb_model = ContentBasedRecommender(item_profiles, items_df, ann_index=ann_index if n_probe else None,
+                                                n_probe=n_probe, quantized=self.cb_quantized, rerank=rerank,
+                                                n_workers=scoring_processes, genre_index=genre_index)
+        self.item_alignment = ItemAlignment(item_profiles.item_ids, svd_model.item_ids)
+        self.item_cf_genre_index = None
+        if item_neighbors is not None and genre_index is not None:
+            self.item_cf_genre_index = genre_index.aligned(item_neighbors.item_ids)
+
+        # batching: concurrent CB / CF requests are scored together by micro-batchers, see Batching.py.
+        # A batch never holds more requests than are in flight, i.e. about n_workers. A request waits for its
+        # scores at most request_timeout seconds, so it cannot hang on a batcher that was closed by a reload.
+        self.cb_batcher = self.cf_batcher = None
+        if batching:
+            self.cb_batcher = MicroBatcher(self.cb_model.score_profiles, max_batch_size, max_wait_ms, 'cb-batcher',
+                                           timeout=request_timeout)
+            self.cf_batcher = MicroBatcher(CFRecommender(svd_model, **self.cf_options).predict_batch, max_batch_size,
+                                           max_wait_ms, 'cf-batcher', timeout=request_timeout)
+            self.cb_model.batcher = self.cb_batcher
+
+    def quantization_metrics(self):
+        if not self.quantization:
+            return {}
+        matrices = (('content-based', self.cb_quantized, self.item_profiles.tfidf_matrix_norm),
+                    ('collaborative-filtering', self.cf_quantized, self.svd_model.Vt))
+        return {name: {'dtype': self.quantization, 'memory_mb': quantized.nbytes / 1024 ** 2,
+                       'full_memory_mb': matrix_nbytes(matrix) / 1024 ** 2}
+                for name, quantized, matrix in matrices}
+
+    def close(self):
+        if self.cb_batcher is not None:
+            self.cb_batcher.close()
+            self.cf_batcher.close()
+        for scorers in (self.item_profiles.sharded_scorers, self.svd_model.sharded_scorers):
+            for scorer in scorers.values():
+                scorer.close()
+
+
+class RecommendationService:
+    # Holds the five models once per process and answers requests on a warm pool of worker threads.
+    # The shared state (item profiles, SVD factors, leaderboards) is read-only; the per-request objects
+    # (user profile, folded-in CF user, hybrid) are cheap wrappers built by the worker.
+
+    def __init__(self, item_profiles, svd_model, genre_leaderboards=None, popularity_df=None, items_df=None,
+                 n_workers=4, hybrid_timeout=None, request_timeout=30.0, batching=False, max_batch_size=32,
+                 max_wait_ms=2.0, version=None, cache_size=10000, cache_ttl=3600.0, ann_index=None, n_probe=None,
+                 quantization=None, rerank=100, scoring_processes=None, genre_index=None, item_neighbors=None):
+        self.items_df = items_df
+        self.model_options = {'batching': batching, 'max_batch_size': max_batch_size, 'max_wait_ms': max_wait_ms,
+                              'n_probe': n_probe, 'quantization': quantization, 'rerank': rerank,
+                              'scoring_processes': scoring_processes, 'request_timeout': request_timeout}
+        self.models = ServingModels(item_profiles, svd_model, genre_leaderboards, popularity_df, items_df,
+                                    version=version, ann_index=ann_index, genre_index=genre_index,
+                                    item_neighbors=item_neighbors, **self.model_options)
+
+        # Results keyed by the canonical request; cache_size=0 disables it
+        self.cache = RecommendationCache(cache_size, cache_ttl, version=version) if cache_size else None
+
+        # Set by from_artifacts: the CURRENT pointer is re-read at most every reload_interval seconds
+        self.artifacts_root = None
+        self.reload_interval = None
+        self.content_space = 'tfidf'
+        self.last_reload_check = time.monotonic()
+        self.reload_lock = Lock()
+
+        self.hybrid_timeout = hybrid_timeout
+        self.request_timeout = request_timeout
+        self.executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='recommend')
+        # The hybrid's two branches get their own pool, so they never wait behind queued requests
+        self.hybrid_executor = ThreadPoolExecutor(max_workers=2 * n_workers, thread_name_prefix='hybrid')
+        self.n_workers = n_workers
+        self.stats = LatencyStats()
+
+    @classmethod
+    def from_artifacts(cls, model_artifacts, items_df=None, reload_interval=10.0, content_space='tfidf', **kwargs):
+        # content_space='embedding' scores content-based requests on the LSA embeddings of the build;
+        # the IVF index is over the TF-IDF rows, so it is only used in the 'tfidf' space
+        service = cls(model_artifacts.item_profiles(content_space), model_artifacts.svd_model(),
+                      model_artifacts.genre_leaderboards(), model_artifacts.item_popularity(), items_df,
+                      version=model_artifacts.version, ann_index=cls._ann_index(model_artifacts, content_space),
+                      genre_index=model_artifacts.genre_index(), item_neighbors=model_artifacts.item_neighbors(),
+                      **kwargs)
+        service.artifacts_root = model_artifacts.root
+        service.reload_interval = reload_interval
+        service.content_space = content_space
+        return service
+
+    @staticmethod
+    def _ann_index(model_artifacts, content_space):
+        return model_artifacts.ann_index() if content_space == 'tfidf' else None
+
+    def reload(self, model_artifacts):
+        # Swaps in the models of another artifact version; cached results of the old version are dropped
+        models = ServingModels(model_artifacts.item_profiles(self.content_space), model_artifacts.svd_model(),
+                               model_artifacts.genre_leaderboards(), model_artifacts.item_popularity(),
+                               self.items_df, version=model_artifacts.version,
+                               ann_index=self._ann_index(model_artifacts, self.content_space),
+                               genre_index=model_artifacts.genre_index(),
+                               item_neighbors=model_artifacts.item_neighbors(), **self.model_options)
+        old_models, self.models = self.models, models
+        if self.cache is not None:
+            self.cache.set_version(models.version)
+        # Requests still running on the old set may use its batchers until they time out
+        Timer(self.request_timeout, old_models.close).start()
+
+    def add_interactions(self, interactions_df):
+        # New (Uid, Review_Rating) interactions, added to the popularity scores of the serving set without a
+        # rebuild; cached results are dropped. A reload replaces them with the scores of the new artifacts.
+        self.models.popularity_model.update(interactions_df)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _check_for_new_version(self):
+        if self.artifacts_root is None or time.monotonic() - self.last_reload_check < self.reload_interval:
+            return
+        with self.reload_lock:
+            if time.monotonic() - self.last_reload_check < self.reload_interval:
+                return
+            self.last_reload_check = time.monotonic()
+            if current_version(self.artifacts_root) != self.models.version:
+                self.reload(load_artifacts(self.artifacts_root))
+
+    def _recommend(self, models, model, ratings_df, genres, topn, genre_mode='any'):
+        items_to_ignore = ratings_df['Uid'].values
+
+        if model == 'popularity':
+            recommend_df = models.popularity_model.recommend_items(items_to_ignore=items_to_ignore, topn=topn,
+                                                                   genres=genres, genre_mode=genre_mode)
+            return recommend_df['Uid'].values, recommend_df['Review_Rating'].values
+        if len(ratings_df) == 0:
+            raise ValueError('The %s model needs at least one rated book' % model)
+        # The other models only filter by genre with a genre index
+        if models.genre_index is None:
+            genres = None
+
+        if model == 'content-based':
+            user_profile = build_users_profiles(ratings_df, models.item_profiles)
+            recommend_df = models.cb_model.recommend_items(NEW_USER_ID, user_profile, items_to_ignore=items_to_ignore,
+                                                           topn=topn, genres=genres, genre_mode=genre_mode)
+            return recommend_df['Uid'].values, recommend_df['Review_Rating'].values
+
+        if model == 'item-based':
+            if models.item_neighbors is None:
+                raise ValueError('The item-based model needs artifacts built with item neighbors (--neighbors)')
+            item_cf_model = ItemCFRecommender(models.item_neighbors, self.items_df,
+                                              genre_index=models.item_cf_genre_index)
+            item_cf_model.add_user(NEW_USER_ID, ratings_df)
+            recommend_df = item_cf_model.recommend_items(NEW_USER_ID, items_to_ignore=items_to_ignore, topn=topn,
+                                                         genres=genres, genre_mode=genre_mode)
+            return recommend_df['Uid'].values, recommend_df['Review_Rating'].values
+
+        cf_model = CFRecommender(models.svd_model, self.items_df, batcher=models.cf_batcher, **models.cf_options)
+        cf_model.add_user(NEW_USER_ID, ratings_df)
+        if model == 'collaborative-filtering':
+            recommend_df = cf_model.recommend_items(NEW_USER_ID, items_to_ignore=items_to_ignore, topn=topn,
+                                                    genres=genres, genre_mode=genre_mode)
+            return recommend_df['Uid'].values, recommend_df['Review_Rating'].values
+
+        user_profile = build_users_profiles(ratings_df, models.item_profiles)
+        hybrid_model = HybridRecommender(models.cb_model, cf_model, self.items_df,
+                                         item_alignment=models.item_alignment,
+                                         parallel=self.hybrid_timeout is not None, timeout=self.hybrid_timeout,
+                                         executor=self.hybrid_executor)
+        recommend_df = hybrid_model.recommend_items(NEW_USER_ID, user_profile, items_to_ignore=items_to_ignore,
+                                                    topn=topn, genres=genres, genre_mode=genre_mode)
+        return recommend_df['Uid'].values, recommend_df['Rating_Hybrid'].values
+
+    def recommend(self, model, ratings=None, genres=None, topn=10, genre_mode='any'):
+        # ratings: {Uid: rating} of the requesting user; genres: books of any ('any') or all ('all') of these
+        # genres only. The other models than popularity ignore genres when the service has no genre index.
+        # Returns a DataFrame with Uid and Score, best first.
+        if model not in MODELS:
+            raise ValueError('Unknown model: %s (expected one of %s)' % (model, ', '.join(MODELS)))
+        if genre_mode not in GENRE_MODES:
+            raise ValueError('Unknown genre mode: %s (expected one of %s)' % (genre_mode, ', '.join(GENRE_MODES)))
+        if topn < 1:
+            raise ValueError('topn must be at least 1, got %d' % topn)
+        ratings = ratings or {}
+        if model != 'popularity' and self.models.genre_index is None:
+            genres = None
+
+        start = time.perf_counter()
+        self._check_for_new_version()
+        key = request_key(model, genres, ratings, topn, genre_mode)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            self.stats.record('/recommend?model=' + model, time.perf_counter() - start)
+            return pd.DataFrame({'Uid': cached[0], 'Score': cached[1]})
+
+        ratings_df = pd.DataFrame({'Uid': np.array(list(ratings.keys()), dtype=np.int64),
+                                   'UserID': NEW_USER_ID,
+                                   'Review_Rating': np.array(list(ratings.values()), dtype=np.float64)})
+        models = self.models
+        error = True
+        try:
+            future = self.executor.submit(self._recommend, models, model, ratings_df, genres, topn, genre_mode)
+            uids, scores = future.result(timeout=self.request_timeout)
+            error = False
+        finally:
+            self.stats.record('/recommend?model=' + model, time.perf_counter() - start, error)
+
+        uids, scores = np.asarray(uids), np.asarray(scores, dtype=np.float64)
+        # A result computed by a set that was swapped out meanwhile is not cached under the new version
+        if self.cache is not None and models is self.models:
+            uids.flags.writeable = False
+            scores.flags.writeable = False
+            self.cache.put(key, (uids, scores))
+        return pd.DataFrame({'Uid': uids, 'Score': scores})
+
+    def warm_up(self, n_ratings=5):
+        # One request per model on every worker, so the memory-mapped artifacts are paged in and the
+        # BLAS / sparse code paths are initialized before the first real request. Bypasses the cache.
+        models = self.models
+        # Books both models know, so the sample is not empty when the two catalogs only partly overlap
+        sample = np.intersect1d(models.svd_model.item_ids, models.item_profiles.item_ids)[:n_ratings]
+        ratings_df = pd.DataFrame({'Uid': sample, 'UserID': NEW_USER_ID, 'Review_Rating': 5.0})
+        leaderboards = models.popularity_model.leaderboards
+        genres = leaderboards.genres[:1] if leaderboards is not None else None
+        futures = [self.executor.submit(self._recommend, models, model, ratings_df, genres, 10)
+                   for _ in range(self.n_workers) for model in MODELS
+                   if model != 'item-based' or models.item_neighbors is not None]
+        for future in futures:
+            future.result()
+
+    def batching_metrics(self):
+        models = self.models
+        if models.cb_batcher is None:
+            return {}
+        return {'content-based': models.cb_batcher.metrics(), 'collaborative-filtering': models.cf_batcher.metrics()}
+
+    def quantization_metrics(self):
+        return self.models.quantization_metrics()
+
+    def cache_metrics(self):
+        return self.cache.metrics() if self.cache is not None else {}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        self.hybrid_executor.shutdown(wait=False)
+        self.models.close()
+
+
+def _json_field(request, name, expected_type, default=None):
+    # request[name] when it has the expected JSON type (null counts as missing), ValueError otherwise
+    value = request.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, expected_type) or isinstance(value, bool):
+        raise ValueError('%s must be a JSON %s' % (name, {str: 'string', dict: 'object', list: 'array',
+                                                          int: 'integer'}[expected_type]))
+    return value
+
+
+def parse_request(query, body=None):
+    # GET: /recommend?model=hybrid&uids=1,2&ratings=5,4&genres=fiction,art&genre_mode=all&topn=10
+    # POST: the same fields as a JSON object, ratings as {"Uid": rating}
+    if body:
+        request = json.loads(body)
+        if not isinstance(request, dict):
+            raise ValueError('The request body must be a JSON object')
+        model = _json_field(request, 'model', str)
+        ratings = _json_field(request, 'ratings', dict) or {}
+        genres = _json_field(request, 'genres', list)
+        topn = _json_field(request, 'topn', int, 10)
+        genre_mode = _json_field(request, 'genre_mode', str, 'any')
+        if genres is not None and not all(isinstance(genre, str) for genre in genres):
+            raise ValueError('genres must be a list of strings')
+        if not all(isinstance(rating, (int, float)) and not isinstance(rating, bool) for rating in ratings.values()):
+            raise ValueError('ratings must map Uids to numbers')
+        try:
+            ratings = {int(uid): float(rating) for uid, rating in ratings.items()}
+        except ValueError:
+            raise ValueError('ratings must be keyed by integer Uids')
+        return model, ratings, genres, topn, genre_mode
+
+    params = {name: values[-1] for name, values in parse_qs(query).items()}
+    uids = [int(uid) for uid in params.get('uids', '').split(',') if uid]
+    ratings = [float(rating) for rating in params.get('ratings', '').split(',') if rating]
+    if len(uids) != len(ratings):
+        raise ValueError('uids and ratings must have the same length')
+    genres = [genre for genre in params['genres'].split(',') if genre] if 'genres' in params else None
+    return (params.get('model'), dict(zip(uids, ratings)), genres, int(params.get('topn', 10)),
+            params.get('genre_mode', 'any'))
+
+
+def parse_interactions(body):
+    # POST /interactions: {"Uid": [...], "Review_Rating": [...]}, one entry per new interaction
+    request = json.loads(body or b'{}')
+    if not isinstance(request, dict):
+        raise ValueError('The request body must be a JSON object')
+    uids = _json_field(request, 'Uid', list, [])
+    ratings = _json_field(request, 'Review_Rating', list, [])
+    if len(uids) != len(ratings):
+        raise ValueError('Uid and Review_Rating must have the same length')
+    if not all(isinstance(uid, int) and not isinstance(uid, bool) for uid in uids) or \
+            not all(isinstance(rating, (int, float)) and not isinstance(rating, bool) for rating in ratings):
+        raise ValueError('Uid must hold integers and Review_Rating numbers')
+    return pd.DataFrame({'Uid': np.array(uids, dtype=np.int64), 'Review_Rating': np.array(ratings, dtype=np.float64)})
+
+
+def make_handler(service):
+
+    class RecommendationHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, body=None):
+            # Anything the handlers below do not turn into a response is answered with a 500, never a dropped
+            # connection: a closed batcher or shard pool during a reload, a bug in a model
+            try:
+                self._dispatch(body)
+            except Exception as e:
+                self._send_json(500, {'error': '%s: %s' % (type(e).__name__, e)})
+
+        def _dispatch(self, body=None):
+            url = urlparse(self.path)
+            if url.path == '/health':
+                self._send_json(200, {'status': 'ok', 'models': list(MODELS)})
+            elif url.path == '/stats':
+                self._send_json(200, {'endpoints': service.stats.summary(), 'batching': service.batching_metrics(),
+                                      'cache': service.cache_metrics(),
+                                      'quantization': service.quantization_metrics()})
+            elif url.path == '/recommend':
+                try:
+                    model, ratings, genres, topn, genre_mode = parse_request(url.query, body)
+                    recommend_df = service.recommend(model, ratings, genres, topn, genre_mode)
+                except (ValueError, KeyError) as e:
+                    self._send_json(400, {'error': str(e)})
+                    return
+                except TimeoutError as e:
+                    self._send_json(504, {'error': str(e)})
+                    return
+                self._send_json(200, {'model': model,
+                                      'Uid': recommend_df['Uid'].tolist(),
+                                      'Score': recommend_df['Score'].tolist()})
+            elif url.path == '/interactions' and body is not None:
+                try:
+                    interactions_df = parse_interactions(body)
+                except ValueError as e:
+                    self._send_json(400, {'error': str(e)})
+                    return
+                service.add_interactions(interactions_df)
+                self._send_json(200, {'interactions': len(interactions_df)})
+            else:
+                self._send_json(404, {'error': 'Unknown endpoint: %s' % url.path})
+
+        def do_GET(self):
+            self._handle()
+
+        def do_POST(self):
+            self._handle(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+        def log_message(self, format, *args):
+            pass
+
+    return RecommendationHandler
+
+
+def serve(service, host='127.0.0.1', port=8502):
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    return server
+
+
+class RecommendationClient:
+    # Thin HTTP client with the same recommend() signature as RecommendationService
+
+    def __init__(self, base_url, timeout=10.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _post(self, path, payload):
+        request = Request(self.base_url + path, data=json.dumps(payload).encode('utf-8'),
+                          headers={'Content-Type': 'application/json'})
+        with urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def _get(self, path, params=None):
+        url = self.base_url + path + ('?' + urlencode(params) if params else '')
+        with urlopen(url, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def recommend(self, model, ratings=None, genres=None, topn=10, genre_mode='any'):
+        ratings = {str(int(uid)): float(rating) for uid, rating in (ratings or {}).items()}
+        response = self._post('/recommend', {'model': model, 'ratings': ratings, 'genres': genres, 'topn': topn,
+                                             'genre_mode': genre_mode})
+        return pd.DataFrame({'Uid': np.array(response['Uid'], dtype=np.int64),
+                             'Score': np.array(response['Score'], dtype=np.float64)})
+
+    def add_interactions(self, interactions_df):
+        return self._post('/interactions', {'Uid': [int(uid) for uid in interactions_df['Uid']],
+                                            'Review_Rating': [float(r) for r in interactions_df['Review_Rating']]})
+
+    def stats(self):
+        return self._get('/stats')
+
+
+if __name__ == '__main__':
+    # Run from Module_3 after building the artifacts, e.g.: python Models/Service.py --port 8502
+    parser = argparse.ArgumentParser(description='Local HTTP/JSON recommendation service')
+    parser.add_argument('--artifacts', default='./pages/Datasets/artifacts')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--hybrid-timeout', type=float, default=2.0)
+    parser.add_argument('--no-warm-up', action='store_true')
+    parser.add_argument('--batching', action='store_true', help='micro-batch concurrent CB / CF scoring')
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='longest wait for a batch to fill')
+    parser.add_argument('--ann-probe', type=int, default=None,
+                        help='search the IVF index with this many clusters for content-based requests')
+    parser.add_argument('--content-space', choices=('tfidf', 'embedding'), default='tfidf',
+                        help="'embedding' needs a build with --embedding-dim")
+    parser.add_argument('--quantize', choices=QUANTIZED_DTYPES, default=None,
+                        help='scan int8 / float16 copies of the CB and CF item matrices')
+    parser.add_argument('--rerank', type=int, default=100,
+                        help='quantized candidates re-scored at full precision, 0 keeps the approximate order')
+    parser.add_argument('--scoring-processes', type=int, default=None,
+                        help='score CB / CF requests on this many processes over shared-memory shards')
+    parser.add_argument('--cache-size', type=int, default=10000, help='cached results, 0 disables the cache')
+    parser.add_argument('--cache-ttl', type=float, default=3600.0, help='seconds a cached result stays valid')
+    parser.add_argument('--reload-interval', type=float, default=10.0,
+                        help='seconds between checks for a new artifact version')
+    args = parser.parse_args()
+
+    service = RecommendationService.from_artifacts(load_artifacts(args.artifacts), n_workers=args.workers,
+                                                   hybrid_timeout=args.hybrid_timeout, batching=args.batching,
+                                                   max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                                                   cache_size=args.cache_size, cache_ttl=args.cache_ttl,
+                                                   reload_interval=args.reload_interval, n_probe=args.ann_probe,
+                                                   content_space=args.content_space, quantization=args.quantize,
+                                                   rerank=args.rerank or None,
+                                                   scoring_processes=args.scoring_processes)
+    if not args.no_warm_up:
+        service.warm_up()
+
+    server = serve(service, args.host, args.port)
+    print('Serving recommendations on http://%s:%d' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
@@ -0,0 +1,125 @@
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+from Ranking import top_k_indices
+
+# Shards of the matrix attached by a worker process, set by _attach
+_worker_shards = None
+
+
+def _to_shared(array):
+    # Copy of array in a new shared memory block, and the (name, shape, dtype) a worker attaches it with
+    array = np.ascontiguousarray(array)
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _from_shared(descriptor, blocks):
+    name, shape, dtype = descriptor
+    shm = SharedMemory(name=name)
+    blocks.append(shm)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _attach(descriptors, shape, bounds):
+    # Worker initializer: maps the shared arrays (no copy) and cuts them into one matrix view per shard
+    global _worker_shards
+    blocks = []
+    arrays = {key: _from_shared(descriptor, blocks) for key, descriptor in descriptors.items()}
+    shards = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if 'indptr' in arrays:
+            indptr = arrays['indptr']
+            lo, hi = indptr[start], indptr[stop]
+            shard = csr_matrix((arrays['data'][lo:hi], arrays['indices'][lo:hi], indptr[start:stop + 1] - lo),
+                               shape=(stop - start, shape[1]), copy=False)
+        else:
+            shard = arrays['data'][start:stop]
+        shards.append((start, stop, shard))
+    # The blocks stay open as long as the worker lives
+    _worker_shards = shards, blocks
+
+
+def _shard_top_k(shard_id, terms, weights, k, ignore_rows):
+    # Partial top-k of one shard: (global rows, scores) of its k best rows for the query sum(weights . e_terms)
+    start, stop, shard = _worker_shards[0][shard_id]
+    query = np.zeros(shard.shape[1], dtype=weights.dtype)
+    query[terms] = weights
+    scores = np.asarray(shard.dot(query)).ravel()
+
+    mask = None
+    ignore_rows = ignore_rows[(ignore_rows >= start) & (ignore_rows < stop)]
+    if len(ignore_rows):
+        mask = np.zeros(stop - start, dtype=bool)
+        mask[ignore_rows - start] = True
+    best = top_k_indices(scores, k, mask)
+    return best + start, scores[best]
+
+
+def _release(executor, blocks):
+    executor.shutdown(wait=True)
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+class ShardedScorer:
+    # Row shards of an (items x d) matrix, dense or CSR, held once in multiprocessing.shared_memory and scored
+    # by a pool of worker processes: every worker maps the same blocks, computes the partial top-k of the
+    # shard it is given, and top_k() merges the partial lists. The query is sent as its nonzero terms.
+    # Workers are started with 'spawn', so the pool is safe to create from a process that runs threads; they
+    # only import this module and Ranking. The blocks are unlinked by close() or when the scorer is collected.
+
+    def __init__(self, matrix, n_workers=None, n_shards=None):
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        self.shape = matrix.shape
+        n_shards = n_shards or self.n_workers
+
+        if issparse(matrix):
+            matrix = matrix.tocsr()
+            arrays = {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr}
+            # Shards of about the same number of nonzeros
+            targets = np.linspace(0, matrix.nnz, n_shards + 1)[1:-1]
+            inner = np.searchsorted(matrix.indptr, targets)
+        else:
+            arrays = {'data': np.asarray(matrix)}
+            inner = np.linspace(0, matrix.shape[0], n_shards + 1)[1:-1].astype(np.int64)
+        self.bounds = np.unique(np.concatenate([[0], inner, [matrix.shape[0]]])).tolist()
+        self.dtype = arrays['data'].dtype
+
+        blocks, descriptors = [], {}
+        for key, array in arrays.items():
+            shm, descriptors[key] = _to_shared(array)
+            blocks.append(shm)
+
+        self.executor = ProcessPoolExecutor(max_workers=self.n_workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_attach, initargs=(descriptors, self.shape, self.bounds))
+        self._finalizer = weakref.finalize(self, _release, self.executor, blocks)
+
+    @property
+    def n_shards(self):
+        return len(self.bounds) - 1
+
+    def top_k(self, query, k, mask=None):
+        # (rows, scores) of the k best rows of matrix . query, best first; rows where mask is True are skipped
+        query = np.asarray(query, dtype=self.dtype).ravel()
+        terms = np.flatnonzero(query)
+        ignore_rows = np.flatnonzero(mask) if mask is not None else np.empty(0, dtype=np.int64)
+
+        futures = [self.executor.submit(_shard_top_k, shard_id, terms, query[terms], k, ignore_rows)
+                   for shard_id in range(self.n_shards)]
+        partials = [future.result() for future in futures]
+        rows = np.concatenate([rows for rows, _ in partials])
+        scores = np.concatenate([scores for _, scores in partials])
+        best = top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+    def close(self):
+        self._finalizer()
+
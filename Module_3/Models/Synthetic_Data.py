@@ -0,0 +1,163 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, save_npz
+
+BASE_GENRES = ['fiction', 'art', 'history', 'science', 'fantasy', 'romance', 'mystery', 'poetry', 'biography',
+               'philosophy', 'horror', 'psychology', 'business', 'travel', 'religion', 'music', 'sports', 'comics']
+AWARDS = ['Goodreads Choice Award', 'Pulitzer Prize', 'Hugo Award', 'Nebula Award', 'Booker Prize',
+          'National Book Award', 'Locus Award', 'Edgar Award', 'Costa Book Award', 'Newbery Medal']
+
+
+class SyntheticGoodReads:
+    # Offline generator of GoodReads-shaped datasets for scale tests: the interactions sheet, the selected books
+    # sheet (Genres / Award list columns), the book info sheet (one row per book and genre) and a TF-IDF-shaped
+    # sparse matrix whose rows follow the selected books. Book popularity and user activity are power-law.
+
+    def __init__(self, n_users=10000, n_books=5000, n_genres=12, interactions_per_user=20, vocab_size=20000,
+                 terms_per_book=80, popularity_exponent=1.1, genre_affinity=0.7, seed=42):
+        self.n_users = n_users
+        self.n_books = n_books
+        self.n_genres = n_genres
+        self.interactions_per_user = interactions_per_user
+        self.vocab_size = vocab_size
+        self.terms_per_book = terms_per_book
+        self.popularity_exponent = popularity_exponent
+        self.genre_affinity = genre_affinity  # share of a user's ratings drawn from their favourite genre
+        self.rng = np.random.default_rng(seed)
+
+        self.genres = (BASE_GENRES + ['genre_%d' % i for i in range(len(BASE_GENRES), n_genres)])[:n_genres]
+        self.uids = np.sort(self.rng.choice(np.arange(1, 100 * n_books + 1), n_books, replace=False))
+        self.book_genres = self.rng.integers(0, n_genres, n_books)
+
+        # Zipf-like popularity over a random permutation of the books
+        ranks = self.rng.permutation(n_books) + 1
+        self.popularity = ranks ** -popularity_exponent
+        self.quality = np.clip(self.rng.normal(3.9, 0.35, n_books), 1.0, 5.0)
+
+    def _sample_books(self, genre_codes):
+        # Draws one book per entry of genre_codes (-1 = any genre), proportionally to popularity
+        books = np.empty(len(genre_codes), dtype=np.int64)
+        groups = [(-1, np.arange(self.n_books))] + \
+                 [(g, np.flatnonzero(self.book_genres == g)) for g in range(self.n_genres)]
+        for genre, candidates in groups:
+            positions = np.flatnonzero(genre_codes == genre)
+            if len(positions) == 0:
+                continue
+            if len(candidates) == 0:
+                candidates = np.arange(self.n_books)
+            cumulative = np.cumsum(self.popularity[candidates])
+            draws = self.rng.random(len(positions)) * cumulative[-1]
+            books[positions] = candidates[np.minimum(np.searchsorted(cumulative, draws), len(candidates) - 1)]
+        return books
+
+    def interactions(self):
+        # Heavy-tailed number of ratings per user (at least one)
+        activity = np.maximum(1, np.round(self.rng.lognormal(np.log(self.interactions_per_user), 0.8,
+                                                             self.n_users))).astype(np.int64)
+        user_codes = np.repeat(np.arange(self.n_users), activity)
+        favourite_genre = self.rng.integers(0, self.n_genres, self.n_users)[user_codes]
+        genre_codes = np.where(self.rng.random(len(user_codes)) < self.genre_affinity, favourite_genre, -1)
+        books = self._sample_books(genre_codes)
+
+        ratings = np.clip(np.round(self.quality[books] + self.rng.normal(0, 0.9, len(books))), 1, 5)
+        days = self.rng.integers(0, 5 * 365, len(books))
+
+        interactions_df = pd.DataFrame({'Uid': self.uids[books],
+                                        'UserID': 10000000 + user_codes,
+                                        'Review_Rating': ratings.astype(np.int64),
+                                        'Review_Date': pd.Timestamp('2018-01-01') + pd.to_timedelta(days, unit='D')})
+        return interactions_df.drop_duplicates(['UserID', 'Uid']).reset_index(drop=True)
+
+    def _list_column(self, choices, counts, first=None):
+        # String-encoded Python lists, as they come out of the Google Sheets export
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        picks = self.rng.integers(0, len(choices), offsets[-1])
+        lists = []
+        for i in range(len(counts)):
+            values = [] if first is None else [first[i]]
+            for j in picks[offsets[i]:offsets[i + 1]]:
+                if choices[j] not in values:
+                    values.append(choices[j])
+            lists.append(str(values))
+        return lists
+
+    def books(self):
+        rating_num = np.maximum(1, (self.popularity / self.popularity.max() * 2000000).astype(np.int64))
+        star_split = self.rng.dirichlet([1, 1, 2, 4, 6], self.n_books)
+        stars = (star_split * rating_num[:, None]).astype(np.int64)
+        extra_genres = self.rng.poisson(2, self.n_books)
+
+        books_df = pd.DataFrame({
+            'Uid': self.uids,
+            'Title': ['Synthetic Book %d' % uid for uid in self.uids],
+            'Author': ['Author %d' % a for a in self.rng.integers(0, max(1, self.n_books // 3), self.n_books)],
+            'Genre': [self.genres[g] for g in self.book_genres],
+            'Rating': np.round(self.quality, 2),
+            'Rating_Num': rating_num,
+            'Review_Num': (rating_num * self.rng.uniform(0.02, 0.1, self.n_books)).astype(np.int64),
+            'One_Star': stars[:, 0], 'Two_Star': stars[:, 1], 'Three_Star': stars[:, 2],
+            'Four_Star': stars[:, 3], 'Five_Star': stars[:, 4],
+        })
+        books_df['Genres'] = self._list_column(self.genres, extra_genres, first=books_df['Genre'].values)
+        books_df['Full_Genres'] = books_df['Genres']
+        books_df['Award'] = self._list_column(AWARDS, self.rng.poisson(0.3, self.n_books))
+        return books_df
+
+    def info(self, books_df):
+        # Book info sheet: one row per (book, genre) for the primary genre and, for ~30% of books, a second one
+        second = self.rng.random(self.n_books) < 0.3
+        extra = books_df[second].copy()
+        extra['Genre'] = [self.genres[g] for g in self.rng.integers(0, self.n_genres, second.sum())]
+        return pd.concat([books_df, extra], ignore_index=True).drop_duplicates(['Uid', 'Genre'])
+
+    def tfidf_matrix(self):
+        # Rows follow self.uids. Terms mix a genre-specific Zipf vocabulary block with a global Zipf vocabulary,
+        # weights are log-scaled counts and every row is L2-normalized like TfidfVectorizer output.
+        n_terms = np.maximum(1, self.rng.poisson(self.terms_per_book, self.n_books))
+        rows = np.repeat(np.arange(self.n_books), n_terms)
+        block = max(1, self.vocab_size // (2 * self.n_genres))
+
+        zipf_global = np.minimum(self.rng.zipf(1.3, len(rows)), self.vocab_size) - 1
+        zipf_genre = (np.minimum(self.rng.zipf(1.5, len(rows)), block) - 1) + self.book_genres[rows] * block
+        terms = np.where(self.rng.random(len(rows)) < 0.5, zipf_genre, zipf_global) % self.vocab_size
+
+        weights = 1.0 + np.log1p(self.rng.poisson(2, len(rows)))
+        matrix = csr_matrix((weights, (rows, terms)), shape=(self.n_books, self.vocab_size))
+        matrix.sum_duplicates()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        matrix = csr_matrix(matrix.multiply(1.0 / norms[:, None]))
+        return matrix
+
+    def write(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        books_df = self.books()
+        interactions_df = self.interactions()
+
+        books_df.drop(columns=['Genre', 'Full_Genres']).to_csv(os.path.join(out_dir, 'books_selected.csv'),
+                                                               index=False)
+        self.info(books_df).drop(columns=['Genres']).to_csv(os.path.join(out_dir, 'info.csv'), index=False)
+        interactions_df.to_csv(os.path.join(out_dir, 'interactions.csv'), index=False)
+        save_npz(os.path.join(out_dir, 'tfidf_matrix.npz'), self.tfidf_matrix())
+        return len(interactions_df)
+
+
+if __name__ == '__main__':
+    # e.g. python Models/Synthetic_Data.py --out ./synthetic --users 1000000 --books 200000
+    parser = argparse.ArgumentParser(description='Generate GoodReads-shaped synthetic datasets for scale testing')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--genres', type=int, default=12)
+    parser.add_argument('--interactions-per-user', type=float, default=20)
+    parser.add_argument('--vocab', type=int, default=20000)
+    parser.add_argument('--terms-per-book', type=int, default=80)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    generator = SyntheticGoodReads(n_users=args.users, n_books=args.books, n_genres=args.genres,
+                                   interactions_per_user=args.interactions_per_user, vocab_size=args.vocab,
+                                   terms_per_book=args.terms_per_book, seed=args.seed)
+    n_interactions = generator.write(args.out)
+    print('Wrote %d users, %d books and %d interactions to %s' % (args.users, args.books, n_interactions, args.out))
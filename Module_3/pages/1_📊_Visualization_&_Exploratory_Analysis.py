@@ -1,11 +1,13 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from ast import literal_eval
 
 import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
+import sys
+sys.path.append("./Models")
+from Datasets import DATASETS, load_dataset, load_list_column
 
 st.set_page_config(
     page_title="Visualization & EDA",
@@ -17,39 +19,24 @@ st.title('📊 Visualization & Exploratory Analysis')
 
 
 @st.cache_resource
-def load_data_google(sheets_url):
-    csv_url = sheets_url.replace("/edit#gid=", "/export?format=csv&gid=")
-    return pd.read_csv(csv_url)
+def load_data(name, columns=None):
+    # Local snapshot written by `python Models/Datasets.py` when present, otherwise the Google Sheet in secrets
+    return load_dataset(name, st.secrets.get(DATASETS[name]), columns=columns)
 
 
-@st.cache_data
-def list_transform(df):
-    df['Full_Genres'] = df['Full_Genres'].apply(lambda x: literal_eval(x) if "[" in x else x)
-    df['Award'] = df['Award'].apply(lambda x: literal_eval(x) if "[" in x else x)
-    return df
+@st.cache_resource
+def load_lists(name, column):
+    # List column parsed once by `python Models/Datasets.py`; only parsed here when the dataset has no snapshot
+    return load_list_column(name, column, st.secrets.get(DATASETS[name]))
 
 
 @st.cache_data
-def award_encode(df):
-    df = df.reset_index(drop=True)
-    award_set = set([])
-    for index, award_list in df['Award'].items():
-        award_set.update(award_list)
-
-    award_df = pd.DataFrame(columns=award_set)
-    award_df = award_df.sort_index(axis=1)
-
-    award_data = np.zeros((len(df['Award']), len(award_set)))
-
-    for index, award_list in df['Award'].items():
-        for award in award_list:
-            # if award exists in this book's award entry, we retrieve its index and put '1' to encode
-            if award in list(award_df.columns):
-                col_index = list(award_df.columns).index(award)
-                award_data[index, col_index] = 1
-
-    award_count = pd.DataFrame(award_data, columns=award_df.columns, dtype='int64')
-    return award_count
+def award_encode(_awards, rows=None):
+    # 0/1 matrix (books x awards) of the Award lists, optionally of some rows only, over the awards they won
+    awards = _awards if rows is None else _awards.take(rows)
+    award_matrix = awards.indicator()
+    won = np.flatnonzero(award_matrix.getnnz(axis=0))
+    return pd.DataFrame(award_matrix[:, won].toarray(), columns=awards.vocabulary[won], dtype='int64')
 
 
 @st.cache_data
@@ -108,13 +95,13 @@ st.markdown(
 )
 
 # df_info = load_data_google('https://docs.google.com/spreadsheets/d/1pKiV2vD3ZTvjqg0EYyYa9-3whnVaFhGQoYQCHlk7GRE/edit#gid=1668223231')
-df_info = load_data_google(st.secrets['info_url'])
-df_info = list_transform(df_info)
+df_info = load_data('info')
+info_awards = load_lists('info', 'Award')
 
 st.dataframe(df_info.head(10))
 
 # book_stats = load_data_google('https://docs.google.com/spreadsheets/d/1Oxbmc_OP3GTwPiXhYyoXUVK-pEgancDejCpBFHlF6bc/edit#gid=726264491')
-book_stats = load_data_google(st.secrets['stats_url'])
+book_stats = load_data('stats')
 
 subtab_overview, subtab_genre = st.tabs(['**Overview**', '**Genre**'])
 
@@ -219,7 +206,7 @@ with subtab_overview:
         """
     )
 
-    award_count = award_encode(df_info)
+    award_count = award_encode(info_awards)
     award_series = award_count.sum().sort_values(ascending=False)[1:21]
 
     st.markdown(
@@ -403,7 +390,8 @@ with subtab_genre:
         - Total number of awards won for books under this genre 
         """
     )
-    award_genre = award_encode(df_select).sum().sort_values(ascending=False)
+    select_rows = np.flatnonzero(df_info['Genre'] == genre_selected)
+    award_genre = award_encode(info_awards, select_rows).sum().sort_values(ascending=False)
     award_genre_df = pd.DataFrame(data=award_genre, columns=['Num'])
     award_genre_df.reset_index(inplace=True)
 
@@ -8,20 +8,21 @@ st.set_page_config(
 
 
 import pandas as pd
-import numpy as np
-from ast import literal_eval
 import time
 import sys
 sys.path.append("./Models")
 
 # import models classes
-from Popularity import PopularityRecommender
-from Content_based import ContentBasedRecommender, build_users_profiles
-from Collaborative_Filtering import CFRecommender
-from Hybrid import HybridRecommender
-
-from scipy.sparse import csr_matrix
-from scipy.sparse.linalg import svds
+from Popularity import GenreLeaderboards
+from Genre_index import GenreIndex
+from Datasets import DATASETS, load_dataset
+from Content_based import ItemProfiles
+from Collaborative_Filtering import SVDModel
+from Interactions import InteractionMatrix
+from Artifacts import artifacts_available, load_artifacts
+from Service import RecommendationClient, RecommendationService
+
+from scipy.sparse import load_npz
 import plotly.express as px
 import plotly.graph_objects as go
 
@@ -47,47 +48,93 @@ st.markdown(
 
 
 @st.cache_resource
-def load_data_google(sheets_url):
-    csv_url = sheets_url.replace("/edit#gid=", "/export?format=csv&gid=")
-    return pd.read_csv(csv_url)
+def load_data(name, columns=None):
+    # Local snapshot written by `python Models/Datasets.py` when present, otherwise the Google Sheet in secrets.
+    # columns: only these columns are read from the snapshot / parsed from the CSV
+    return load_dataset(name, st.secrets.get(DATASETS[name]), columns=columns)
 
 
-@st.cache_data
-def list_transform(df):
-    df['Full_Genres'] = df['Full_Genres'].apply(lambda x: literal_eval(x) if "[" in x else x)
-    df['Award'] = df['Award'].apply(lambda x: literal_eval(x) if "[" in x else x)
-    return df
+ARTIFACTS_DIR = "./pages/Datasets/artifacts"
+TFIDF_MATRIX_PATH = "./pages/Datasets/tfidf_matrix.npz"
+# Per-request deadline of each hybrid branch; a late branch is dropped and the other one is used alone
+HYBRID_TIMEOUT_SECONDS = 2.0
+# Worker threads of the in-process service, used when no `recommendation_service_url` secret is set
+SERVICE_WORKERS = 4
 
 
-@st.cache_data
-def list_transform_book(df):
-    df['Genres'] = df['Genres'].apply(lambda x: literal_eval(x) if "[" in x else x)
-    df['Award'] = df['Award'].apply(lambda x: literal_eval(x) if "[" in x else x)
-    return df
+@st.cache_resource
+def load_model_artifacts():
+    # Built offline with `python Models/Artifacts.py`; arrays are memory-mapped and shared between processes
+    if artifacts_available(ARTIFACTS_DIR):
+        return load_artifacts(ARTIFACTS_DIR)
+    return None
 
 
-@st.cache_data
-def svd_pred(user_interactions_df):
-    users_items_pivot_matrix_df = user_interactions_df.pivot(index='UserID',
-                                                             columns='Uid',
-                                                             values='Review_Rating').fillna(0)
+@st.cache_resource
+def load_item_profiles(_model_artifacts, _books_df):
+    if _model_artifacts is not None:
+        return _model_artifacts.item_profiles()
+    return ItemProfiles(load_npz(TFIDF_MATRIX_PATH), _books_df['Uid'].values)
+
 
-    users_items_pivot_matrix = users_items_pivot_matrix_df.to_numpy()
-    users_ids = list(users_items_pivot_matrix_df.index)
+@st.cache_resource
+def load_svd_model(_model_artifacts, _interactions_df):
+    # Factors are trained once per process (or offline, see above) and new users are folded in
+    if _model_artifacts is not None:
+        return _model_artifacts.svd_model()
+    return SVDModel.fit(InteractionMatrix.from_df(_interactions_df[['Uid', 'UserID', 'Review_Rating']]))
 
-    users_items_pivot_sparse_matrix = csr_matrix(users_items_pivot_matrix)
 
-    U, sigma, Vt = svds(users_items_pivot_sparse_matrix, k=23)
-    sigma = np.diag(sigma)
+@st.cache_resource
+def load_item_popularity(_interactions_df):
+    # Overall popularity table (Uid, Review_Rating), computed once per process when there are no artifacts
+    return InteractionMatrix.from_df(_interactions_df[['Uid', 'UserID', 'Review_Rating']]).item_popularity()
 
-    all_user_predicted_ratings = np.dot(np.dot(U, sigma), Vt)
-    all_user_predicted_ratings_norm = (all_user_predicted_ratings - all_user_predicted_ratings.min()) / \
-                                      (all_user_predicted_ratings.max() - all_user_predicted_ratings.min())
 
-    cf_preds_df = pd.DataFrame(all_user_predicted_ratings_norm, columns=users_items_pivot_matrix_df.columns,
-                               index=users_ids).transpose()
+@st.cache_resource
+def load_genre_leaderboards(_model_artifacts, _interactions_df, _df_info):
+    # Popularity tables precomputed per genre, so a genre query no longer touches interactions_df
+    if _model_artifacts is not None:
+        return _model_artifacts.genre_leaderboards()
+    return GenreLeaderboards.build(load_item_popularity(_interactions_df), _df_info)
 
-    return cf_preds_df
+
+@st.cache_resource
+def load_genre_index(_model_artifacts, _books_df, _df_info):
+    # Genre -> book bitmaps over the rows of books_df, so selecting genres is a bitwise OR instead of a string scan
+    genre_index = _model_artifacts.genre_index() if _model_artifacts is not None else None
+    if genre_index is None:
+        genre_index = GenreIndex.build(_books_df['Uid'].values, _df_info)
+    return genre_index.aligned(_books_df['Uid'].values)
+
+
+@st.cache_resource
+def load_genre_picker(_df_info):
+    # Genre -> row bitmaps over df_info (one row per book and genre): the books offered for rating, the same
+    # rows as df_info['Genre'].isin(genres), which include books outside books_df that CF can still use
+    rows = pd.RangeIndex(len(_df_info))
+    return GenreIndex.build(rows, pd.DataFrame({'Uid': rows, 'Genre': _df_info['Genre'].values}))
+
+
+@st.cache_resource
+def load_recommender(_model_artifacts, _item_profiles, _books_df, _interactions_df, _df_info):
+    # Scoring runs in a separate service (python Models/Service.py) when its URL is configured, otherwise in
+    # a warm in-process service with the same recommend() interface; the page only sends the user's ratings
+    if 'recommendation_service_url' in st.secrets:
+        return RecommendationClient(st.secrets['recommendation_service_url'])
+
+    # Results are cached per request and dropped when a new artifact version is built
+    if _model_artifacts is not None:
+        service = RecommendationService.from_artifacts(_model_artifacts, _books_df, n_workers=SERVICE_WORKERS,
+                                                       hybrid_timeout=HYBRID_TIMEOUT_SECONDS)
+    else:
+        service = RecommendationService(_item_profiles, load_svd_model(_model_artifacts, _interactions_df),
+                                        load_genre_leaderboards(_model_artifacts, _interactions_df, _df_info),
+                                        load_item_popularity(_interactions_df), items_df=_books_df,
+                                        n_workers=SERVICE_WORKERS, hybrid_timeout=HYBRID_TIMEOUT_SECONDS,
+                                        genre_index=load_genre_index(_model_artifacts, _books_df, _df_info))
+    service.warm_up()
+    return service
 
 
 def progress_bar():
@@ -284,23 +331,26 @@ def book_summary_process(book_sum):
 
 # load data
 
-df_info = load_data_google(st.secrets['info_url'])
-df_info = list_transform(df_info)
+# this page only needs the (Uid, Genre) pairs and titles of the info sheet
+df_info = load_data('info', ['Uid', 'Genre', 'Title'])
 
-books_df = load_data_google(st.secrets['selected_books_url'])
-books_df = list_transform_book(books_df)
+books_df = load_data('selected_books')
 
-interactions_df = load_data_google(st.secrets['interactions_url'])
+interactions_df = load_data('interactions', ['Uid', 'UserID', 'Review_Rating'])
+
+model_artifacts = load_model_artifacts()
+item_profiles = load_item_profiles(model_artifacts, books_df)
+recommender = load_recommender(model_artifacts, item_profiles, books_df, interactions_df, df_info)
 
 # book tags & review summary
-book_tags = load_data_google(st.secrets['book_tags_url'])
-book_summary = load_data_google(st.secrets['book_summary_url'])[['Uid', 'Summary']]
+book_tags = load_data('book_tags', ['Uid', 'Tags'])
+book_summary = load_data('book_summary', ['Uid', 'Summary'])
 
 # book picture URLs
-book_pic_url = load_data_google(st.secrets['book_pic_url'])
+book_pic_url = load_data('book_pic_url', ['Uid', 'URL'])
 
 # book stats
-book_stats = load_data_google(st.secrets['stats_url'])
+book_stats = load_data('stats')
 
 
 genre_selected = st.multiselect(
@@ -309,7 +359,7 @@ genre_selected = st.multiselect(
                         ['fiction', 'art']
 )
 
-df_select = df_info[df_info['Genre'].isin(genre_selected)]
+df_select = df_info.iloc[load_genre_picker(df_info).rows(genre_selected)]
 
 book_selected = st.multiselect(
         "Please select the books that you have read and provide a rating for each book on a scale of 1 (worst) to 5 (best) to indicate your satisfaction level",
@@ -356,13 +406,7 @@ if not book_selected:
     if st.session_state.button_no_book:
         st.write("If have read none of the books listed, please take a look at the top-rating books in your curious genres:")
 
-        uid_select = df_select['Uid'].unique()
-        interactions_df_selected = interactions_df[interactions_df['Uid'].isin(uid_select)]
-        item_popularity_df = interactions_df_selected.groupby('Uid')['Review_Rating'].sum().sort_values(
-            ascending=False).reset_index()
-
-        popularity_model = PopularityRecommender(item_popularity_df, df_select)
-        recommend_df = popularity_model.recommend_items()
+        recommend_df = recommender.recommend('popularity', genres=genre_selected)
 
         book_rec_uid = recommend_df['Uid'].values
         book_rec_df = books_df[books_df['Uid'].isin(book_rec_uid)]
@@ -374,10 +418,9 @@ if not book_selected:
 
 else:
     # add new user info
-    uid = df_select[df_select['Title'].isin(book_selected)]['Uid'].values
-    n = len(book_selected)
+    # One Uid per selected title, in the order of book_selected (df_select has a row per book and genre)
+    uid = df_select.drop_duplicates('Title').set_index('Title')['Uid'].loc[book_selected]
     new_user_rating = []
-    user_ID = [uid for uid in [13223456] for i in range(n)]
 
     for name in book_selected:
         c1, c2 = st.columns(2)
@@ -392,10 +435,8 @@ else:
             )
             new_user_rating.append(rating)
 
-    # Content-based
-    new_user_df = pd.DataFrame({"Uid": uid,
-                                "UserID": user_ID,
-                                "Review_Rating": new_user_rating})
+    # New user's ratings, sent as {Uid: rating} to the recommendation service
+    new_user_ratings = dict(zip(uid.tolist(), new_user_rating))
 
     model = st.radio(
         "Please select a recommendation approach for you:",
@@ -407,11 +448,8 @@ else:
         st.session_state.button = False
 
     if model == 'Based on your previous reading list and ratings':
-        new_user_profile = build_users_profiles(new_user_df)
-
-        content_based_recommender_model = ContentBasedRecommender(books_df)
-        recommend_df = content_based_recommender_model.recommend_items(user_id=13223456, user_profile=new_user_profile,
-                                                                       items_to_ignore=uid)
+        # Content-based
+        recommend_df = recommender.recommend('content-based', new_user_ratings)
         book_rec_uid = recommend_df['Uid'].values
         book_rec_df = books_df[books_df['Uid'].isin(book_rec_uid)]
 
@@ -429,13 +467,7 @@ else:
 
     if model == 'Based on readers with similar reading tastes':
         # Collaborative filtering
-
-        total_interactions_df = pd.concat([interactions_df[['Uid', 'UserID', 'Review_Rating']], new_user_df], axis=0)
-
-        cf_preds_df = svd_pred(total_interactions_df)
-
-        cf_recommender_model = CFRecommender(cf_preds_df, books_df)
-        book_rec_cf = cf_recommender_model.recommend_items(user_id=13223456, items_to_ignore=uid)
+        book_rec_cf = recommender.recommend('collaborative-filtering', new_user_ratings)
 
         book_cf_uid = book_rec_cf['Uid'].values
         book_rec_df = books_df[books_df['Uid'].isin(book_cf_uid)]
@@ -454,18 +486,7 @@ else:
 
     if model == 'Based on the above two perspectives':
         # Hybrid models
-        new_user_profile = build_users_profiles(new_user_df)
-        content_based_recommender_model = ContentBasedRecommender(books_df)
-
-        total_interactions_df = pd.concat([interactions_df[['Uid', 'UserID', 'Review_Rating']], new_user_df], axis=0)
-        cf_preds_df = svd_pred(total_interactions_df)
-        cf_recommender_model = CFRecommender(cf_preds_df, books_df)
-
-        hybrid_recommender_model = HybridRecommender(content_based_recommender_model, cf_recommender_model, books_df,
-                                                     cb_ensemble_weight=1.0, cf_ensemble_weight=1.0)
-
-        book_rec_hybrid = hybrid_recommender_model.recommend_items(user_id=13223456, user_profile=new_user_profile,
-                                                                   items_to_ignore=uid)
+        book_rec_hybrid = recommender.recommend('hybrid', new_user_ratings)
 
         book_hybrid_uid = book_rec_hybrid['Uid'].values
         book_rec_df = books_df[books_df['Uid'].isin(book_hybrid_uid)]